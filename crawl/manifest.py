@@ -0,0 +1,75 @@
+import json
+import os
+import threading
+
+class CrawlManifest(object):
+    """Per-page crawl status persisted as JSON beside the page cache.
+
+    Each page entry records its status ('ok' or 'failed'), record count,
+    response size in bytes, cumulative attempt count and cache path, so an
+    interrupted crawl can be resumed by refetching only the pages that are
+    missing or failed. The newest record dates seen are kept too, so the
+    crawl's high-water mark survives being resumed.
+    """
+
+    OK = 'ok'
+    FAILED = 'failed'
+
+    def __init__(self, path, save_every=25):
+        self.path = path
+        self.save_every = save_every
+        self.total = None
+        self.query = None
+        self.newest = {}
+        self.pages = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.total = data.get('total')
+            self.query = data.get('query')
+            self.newest = data.get('newest', {})
+            self.pages = data.get('pages', {})
+
+    def entry(self, page_number):
+        return self.pages.get(str(page_number))
+
+    def record(self, page_number, status, records=0, size=0, attempts=1, **extra):
+        with self._lock:
+            previous = self.pages.get(str(page_number), {})
+            entry = dict(
+                status=status,
+                records=records,
+                bytes=size,
+                attempts=previous.get('attempts', 0) + attempts
+            )
+            entry.update(extra)
+            self.pages[str(page_number)] = entry
+            self._unsaved += 1
+            if self._unsaved >= self.save_every:
+                self._save()
+
+    def observe(self, dates):
+        """Keep the newest of each ISO date in `dates`."""
+        with self._lock:
+            for field, value in dates.items():
+                if value > self.newest.get(field, ''): self.newest[field] = value
+
+    def pending(self, page_numbers):
+        """Page numbers from `page_numbers` not yet cached successfully."""
+        return [ix for ix in page_numbers if (self.entry(ix) or {}).get('status') != self.OK]
+
+    def failed(self):
+        return sorted(int(ix) for ix, entry in self.pages.items() if entry['status'] == self.FAILED)
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(total=self.total, query=self.query, newest=self.newest, pages=self.pages), f)
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
@@ -0,0 +1,75 @@
+import json
+import re
+
+# Streams the records out of a cached API page without decoding the whole
+# document: only the current record and one read-ahead chunk are held.
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+DECODER = json.JSONDecoder()
+NUMBER_CHARS = '0123456789.eE+-'
+
+class JSONStream(object):
+    """Incremental reader of JSON values from a text file."""
+
+    def __init__(self, f, chunk_size=65536):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=None):
+        chunk = self.f.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf): return self.buf[self.pos]
+            if not self.fill(): return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if char == '' or char not in chars:
+            raise ValueError("expected %s at offset %s, found %r" % (chars, str(self.pos), char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                (value, end) = DECODER.raw_decode(self.buf, self.pos)
+                # a number cut off by the end of the buffer (12 of 12.5) continues in the next chunk
+                complete = end < len(self.buf) and self.buf[end] not in NUMBER_CHARS
+                if complete or self.eof or not self.fill():
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                # an incomplete value: read at least as much again, so large records cost linear time
+                if self.eof or not self.fill(max(self.chunk_size, len(self.buf) - self.pos)): raise
+
+def iter_page_records(crawl_file, chunk_size=65536):
+    """Yield the records of a cached API page one at a time. A page cached
+    as null yields nothing."""
+    stream = JSONStream(crawl_file, chunk_size)
+    if stream.peek() in ('', 'n'): return
+    stream.expect('{')
+    if stream.peek() == '}': return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key != 'records':
+            stream.value()
+        else:
+            stream.expect('[')
+            if stream.peek() == ']': return
+            while True:
+                yield stream.value()
+                if stream.expect(',]') == ']': return
+        if stream.expect(',}') == '}': return
@@ -0,0 +1,32 @@
+import threading
+import time
+
+class TokenBucket(object):
+    """A thread-safe token bucket limiting request rate across crawler threads.
+
+    Tokens refill continuously at `rate` per second up to `capacity`; each
+    request spends one. A `rate` of None (or 0) disables limiting.
+    """
+
+    def __init__(self, rate=None, capacity=None):
+        self.rate = float(rate) if rate else None
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate or 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def acquire(self, tokens=1):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+                self.waited += wait
+            time.sleep(wait)
@@ -0,0 +1,201 @@
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# A local stand-in for https://api.springernature.com/bookmeta/v1/json serving
+# a synthetic corpus, for load-testing the crawler without spending API quota.
+
+GENRES = ["Monograph", "Contributed volume", "Proceedings", "Graduate/advanced undergraduate textbook", "Handbook"]
+LANGUAGES = ["en", "en", "en", "de", "fr"]
+WORDS = ("analysis systems theory methods applications advances models data learning networks structures "
+    "dynamics processes foundations principles design control optimization computation materials").split()
+# constraint -> (record field, comparison)
+DATE_FILTERS = {
+    'datefrom': ('publicationDate', lambda value, bound: value >= bound),
+    'dateto': ('publicationDate', lambda value, bound: value <= bound),
+    'onlinedatefrom': ('onlineDate', lambda value, bound: value >= bound),
+    'onlinedateto': ('onlineDate', lambda value, bound: value <= bound),
+}
+
+def isbn13(block, number):
+    # 978-3-<block + number>-<check>, e.g. 978-3-030-00042-7
+    digits = '9783%08d' % (block * 100000 + number)
+    check = (10 - sum((3 if ix % 2 else 1) * int(d) for ix, d in enumerate(digits)) % 10) % 10
+    return '%s-%s-%s-%s-%s' % (digits[:3], digits[3], digits[4:7], digits[7:12], str(check))
+
+def words(rnd, count):
+    return ' '.join(rnd.choice(WORDS) for _ in range(count))
+
+def name(rnd):
+    return '%s, %s.' % (words(rnd, 1).capitalize(), rnd.choice('ABCDEFGHJKLMNPRSTW'))
+
+def synthetic_record(number, rnd, newest=date(2022, 6, 30)):
+    published = newest - timedelta(days=rnd.randrange(0, 365 * 40))
+    online = published - timedelta(days=rnd.randrange(0, 60))
+    eisbn = isbn13(30, number)
+    print_isbn = isbn13(60, number)
+    doi = '10.1007/%s' % (eisbn)
+    record = {
+        "contentType": "Book",
+        "identifier": "doi:%s" % (doi),
+        "language": rnd.choice(LANGUAGES),
+        "url": [
+            {"format": "", "platform": "", "value": "http://dx.doi.org/%s" % (doi)},
+            {"format": "pdf", "platform": "", "value": "https://link.springer.com/content/pdf/%s.pdf" % (doi)},
+        ],
+        "title": words(rnd, rnd.randrange(2, 9)).title(),
+        "creators": [{"creator": name(rnd)} for _ in range(rnd.randrange(0, 4))],
+        "bookEditors": [{"bookEditor": name(rnd)} for _ in range(rnd.choice([0, 0, 1, 2, 3, 12]))],
+        "publicationName": words(rnd, 3).title(),
+        "openaccess": "false",
+        "doi": doi,
+        "publisher": "Springer",
+        "publisherName": "Springer, Cham",
+        "publicationDate": published.isoformat(),
+        "onlineDate": online.isoformat(),
+        "copyright": "©%s Springer Nature Switzerland AG" % (str(published.year)),
+        "isbn": print_isbn,
+        "printIsbn": print_isbn,
+        "electronicIsbn": eisbn,
+        "genre": rnd.choice(GENRES),
+        "resourceType": "Book",
+        "abstract": words(rnd, rnd.randrange(0, 600))[:4096],
+    }
+    if rnd.random() < 0.3:
+        record["ePubUrl"] = "https://link.springer.com/download/epub/%s.epub" % (doi)
+    if rnd.random() < 0.2:
+        # some records carry a single url object rather than a list
+        record["url"] = record["url"][1]
+    return record
+
+def synthetic_corpus(size, seed=1):
+    rnd = random.Random(seed)
+    return [synthetic_record(number, rnd) for number in range(1, size + 1)]
+
+class StandIn(object):
+    """Corpus, fault injection settings and request counters shared by handler threads."""
+
+    def __init__(self, corpus, latency=0.0, latency_per_record=0.0, error_rate=0.0, throttle_rate=0.0,
+            stall_rate=0.0, stall_seconds=5.0, seed=1):
+        self.corpus = corpus
+        self.latency = latency
+        self.latency_per_record = latency_per_record
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.counts = dict(requests=0, errors=0, throttled=0, stalled=0)
+        self._random = random.Random(seed)
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def matching(self, query):
+        with self._lock:
+            if query in self._results: return self._results[query]
+        records = self.corpus
+        for term in query.split():
+            (constraint, _, value) = term.partition(':')
+            if constraint in DATE_FILTERS:
+                (field, test) = DATE_FILTERS[constraint]
+                records = [record for record in records if test(record[field], value)]
+        if 'sort:date' in query.split():
+            records = sorted(records, key=lambda record: record['publicationDate'], reverse=True)
+        with self._lock:
+            self._results[query] = records
+        return records
+
+    def fault(self):
+        with self._lock:
+            self.counts['requests'] += 1
+            roll = self._random.random()
+            if roll < self.throttle_rate:
+                self.counts['throttled'] += 1
+                return 429
+            if roll < self.throttle_rate + self.error_rate:
+                self.counts['errors'] += 1
+                return 500
+            if roll < self.throttle_rate + self.error_rate + self.stall_rate:
+                self.counts['stalled'] += 1
+                return 'stall'
+        return None
+
+    def response(self, query, start, per_page):
+        records = self.matching(query)
+        page = records[start - 1:start - 1 + per_page]
+        return {
+            "apiMessage": "This JSON was provided by a local Springer Nature API stand-in",
+            "query": query,
+            "apiKey": "",
+            "result": [{
+                "total": str(len(records)),
+                "start": str(start),
+                "pageLength": str(per_page),
+                "recordsDisplayed": str(len(page))
+            }],
+            "records": page,
+            "facets": []
+        }
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        params = parse_qs(urlparse(self.path).query)
+        query = params.get('q', [''])[0]
+        start = max(1, int(params.get('s', ['1'])[0]))
+        per_page = max(0, int(params.get('p', ['10'])[0]))
+        time.sleep(stand_in.latency + stand_in.latency_per_record * per_page)
+        fault = stand_in.fault()
+        if fault == 'stall':
+            time.sleep(stand_in.stall_seconds)
+        elif fault:
+            self.send_response(fault)
+            if fault == 429: self.send_header('Retry-After', '1')
+            self.end_headers()
+            return
+        body = json.dumps(stand_in.response(query, start, per_page)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stand_in(stand_in, host='127.0.0.1', port=0):
+    """Serve stand_in from a daemon thread; returns (server, endpoint url)."""
+    server = ThreadingHTTPServer((host, port), StandInHandler)
+    server.daemon_threads = True
+    server.stand_in = stand_in
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return (server, 'http://%s:%s/bookmeta/v1/json' % (host, str(server.server_address[1])))
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic Springer bookmeta API locally.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--records", type=int, default=10000, help="size of the synthetic corpus")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--latency-per-record", type=float, default=0.0, help="seconds added per requested record")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="fraction of requests held for --stall-seconds")
+    parser.add_argument("--stall-seconds", type=float, default=5.0)
+    args = parser.parse_args()
+    stand_in = StandIn(synthetic_corpus(args.records), args.latency, args.latency_per_record, args.error_rate,
+        args.throttle_rate, args.stall_rate, args.stall_seconds)
+    (server, endpoint) = start_stand_in(stand_in, port=args.port)
+    print("Serving %s synthetic records at %s" % (str(args.records), endpoint))
+    print("Point the crawler at it with SPRINGER_API_ENDPOINT=%s" % (endpoint))
+    try:
+        while True: time.sleep(60)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
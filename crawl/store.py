@@ -0,0 +1,174 @@
+import glob
+import gzip
+import json
+import os
+import sys
+import threading
+import zlib
+
+class SegmentStore(object):
+    """Crawl records as newline-delimited JSON in gzip segment files.
+
+    Records are appended to the open segment until it holds `segment_bytes`
+    of uncompressed JSON, then the segment is finished and a new one begun.
+    Finished segments are named segment-NNNNNN.ndjson.gz; the open one
+    carries a .part suffix so readers never see a truncated segment.
+
+    Each append() is written as its own gzip member and flushed before it
+    returns, so a page the crawl manifest records as done is on disk even if
+    the crawl is killed. A .part segment left by such a crawl is recovered
+    when the store is next opened: its complete members are kept and indexed
+    and appending continues after them. index.tsv maps each DOI to the
+    segment, compressed offset of its member and offset within the member
+    of its latest record, so get() decompresses one member only.
+    """
+
+    SEGMENT_PATTERN = 'segment-%06d.ndjson.gz'
+    INDEX_NAME = 'index.tsv'
+
+    def __init__(self, base_dir, segment_bytes=64 * 1024 * 1024, compresslevel=6):
+        self.base_dir = base_dir
+        self.segment_bytes = segment_bytes
+        self.compresslevel = compresslevel
+        self._segment = None
+        self._segment_name = None
+        # uncompressed bytes in the open segment, and the compressed offset its next member starts at
+        self._offset = 0
+        self._member_start = 0
+        self._index_entries = []
+        self._index = None
+        self._lock = threading.Lock()
+        os.makedirs(base_dir, exist_ok=True)
+
+    def segment_names(self):
+        return sorted(os.path.basename(path) for path in glob.glob(os.path.join(self.base_dir, 'segment-*.ndjson.gz')))
+
+    def append(self, records):
+        """Append records; returns the name of the segment holding the last of them."""
+        with self._lock:
+            lines = []
+            member_bytes = 0
+            for record in records:
+                if self._segment == None: self._open_segment()
+                line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+                if record.get('doi'): self._index_entries.append((record['doi'], self._member_start, member_bytes))
+                lines.append(line)
+                member_bytes += len(line)
+                self._offset += len(line)
+                if self._offset >= self.segment_bytes:
+                    self._write_member(lines)
+                    (lines, member_bytes) = ([], 0)
+                    self._finish_segment()
+            if lines: self._write_member(lines)
+            return self._segment_name
+
+    def close(self):
+        with self._lock:
+            if self._segment != None: self._finish_segment()
+
+    def _open_segment(self):
+        parts = sorted(glob.glob(os.path.join(self.base_dir, 'segment-*.ndjson.gz.part')))
+        if parts:
+            # left open by a crawl that was killed: carry on appending to it
+            self._segment_name = os.path.basename(parts[-1])[:-len('.part')]
+            (self._member_start, self._offset, self._index_entries) = self._recover(parts[-1])
+        else:
+            names = self.segment_names()
+            number = (int(names[-1][8:14]) + 1) if names else 1
+            self._segment_name = self.SEGMENT_PATTERN % number
+            (self._member_start, self._offset, self._index_entries) = (0, 0, [])
+        self._segment = open(os.path.join(self.base_dir, self._segment_name + '.part'), 'ab')
+
+    def _recover(self, part_path):
+        """Truncate a .part segment after its last complete member; returns
+        (compressed size, uncompressed size, index entries) of what is kept."""
+        with open(part_path, 'rb') as part:
+            data = part.read()
+        (position, offset, entries) = (0, 0, [])
+        while position < len(data):
+            member = zlib.decompressobj(wbits=31)
+            try:
+                text = member.decompress(data[position:])
+            except zlib.error:
+                break
+            if not member.eof: break
+            member_bytes = 0
+            for line in text.splitlines(keepends=True):
+                doi = json.loads(line).get('doi')
+                if doi: entries.append((doi, position, member_bytes))
+                member_bytes += len(line)
+            offset += len(text)
+            position = len(data) - len(member.unused_data)
+        if position < len(data):
+            with open(part_path, 'r+b') as part:
+                part.truncate(position)
+        return (position, offset, entries)
+
+    def _write_member(self, lines):
+        member = gzip.compress(b''.join(lines), compresslevel=self.compresslevel, mtime=0)
+        self._segment.write(member)
+        self._segment.flush()
+        self._member_start += len(member)
+
+    def _finish_segment(self):
+        self._segment.close()
+        path = os.path.join(self.base_dir, self._segment_name)
+        os.replace(path + '.part', path)
+        with open(os.path.join(self.base_dir, self.INDEX_NAME), 'a') as index:
+            for (doi, member, offset) in self._index_entries:
+                index.write('%s\t%s\t%s\t%s\n' % (doi, self._segment_name, str(member), str(offset)))
+        self._segment = None
+        self._index_entries = []
+
+    def records(self):
+        """Stream every record in segment order, one decoded dict at a time."""
+        for name in self.segment_names():
+            with gzip.open(os.path.join(self.base_dir, name), 'rb') as segment:
+                for line in segment:
+                    yield json.loads(line)
+
+    def index(self):
+        if self._index == None:
+            self._index = {}
+            index_path = os.path.join(self.base_dir, self.INDEX_NAME)
+            if os.path.exists(index_path):
+                with open(index_path) as index:
+                    for line in index:
+                        fields = line.rstrip('\n').split('\t')
+                        if len(fields) == 3:
+                            # written before segments were split into members: offset into the whole stream
+                            fields.insert(2, '0')
+                        (doi, name, member, offset) = fields
+                        self._index[doi] = (name, int(member), int(offset))
+        return self._index
+
+    def get(self, doi):
+        """The latest stored record for doi, or None."""
+        location = self.index().get(doi)
+        if location == None: return None
+        (name, member, offset) = location
+        with open(os.path.join(self.base_dir, name), 'rb') as f:
+            f.seek(member)
+            with gzip.GzipFile(fileobj=f) as segment:
+                segment.seek(offset)
+                return json.loads(segment.readline())
+
+def main():
+    # pack the JSON pages listed in a crawl log into a segment store
+    crawl_log_path = sys.argv[1]
+    store = SegmentStore(sys.argv[2])
+    pages = 0
+    records = 0
+    with open(crawl_log_path) as crawl_log:
+        for crawl_cache in crawl_log:
+            with open(crawl_cache.rstrip()) as crawl_file:
+                crawl_json = json.load(crawl_file)
+            if crawl_json == None: continue
+            store.append(crawl_json['records'])
+            pages += 1
+            records += len(crawl_json['records'])
+    store.close()
+    print("Packed %s records from %s pages into %s segments" % (str(records), str(pages), str(len(store.segment_names()))))
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import os
 from configparser import ConfigParser
 from sqlalchemy.engine.url import make_url
 from .model import SessionManager
+from .util import blank_string, blank_value
 
 MY_PATH = os.path.dirname(__file__)
 config_path = os.path.join(MY_PATH, '..', "config.ini")
@@ -9,11 +10,11 @@ config_path = os.path.join(MY_PATH, '..', "config.ini")
 config = ConfigParser()
 config.read(config_path)
 
-_url = config['DATABASE']['url']
-db_session = SessionManager.session(make_url(_url))
-
-def blank_string(val):
-	return (val == None) or (str(val).rstrip() == '')
-
-def blank_value(val):
-	return (val == {}) or (val == []) or (blank_string(val))
+def __getattr__(name):
+	# the session connects and creates the tables, so it is only made once
+	# something imports it; tools that only read files never touch the database
+	if name == 'db_session':
+		global db_session
+		db_session = SessionManager.session(make_url(config['DATABASE']['url']))
+		return db_session
+	raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,96 @@
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Precompressed siblings of feed pages (page.json.gz, page.json.br), for a
+# web server to send as they are instead of compressing each response.
+# zlib and brotli release the GIL, so pages compress in parallel threads.
+
+def gzip_bytes(data):
+    # mtime 0, so an unchanged page compresses to identical bytes
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+def brotli_bytes(data):
+    return brotli.compress(data, quality=11, mode=brotli.MODE_TEXT)
+
+ENCODINGS = {'gz': gzip_bytes, 'br': brotli_bytes}
+
+def available(encoding):
+    return encoding == 'gz' or (encoding == 'br' and brotli != None)
+
+def sibling_path(path, encoding):
+    return "%s.%s" % (path, encoding)
+
+def remove_page(path):
+    """Remove a page and any compressed siblings of it."""
+    for page_path in [path] + [sibling_path(path, encoding) for encoding in ENCODINGS]:
+        if os.path.exists(page_path): os.remove(page_path)
+
+def compress_file(path, encodings):
+    """Write each sibling of path; returns (page bytes, {encoding: compressed bytes})."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    sizes = {}
+    for encoding in encodings:
+        compressed = ENCODINGS[encoding](data)
+        out_path = sibling_path(path, encoding)
+        with open(out_path + '.tmp', 'wb') as out:
+            out.write(compressed)
+        os.replace(out_path + '.tmp', out_path)
+        sizes[encoding] = len(compressed)
+    return (len(data), sizes)
+
+class PageCompressor(object):
+    """Keeps the compressed siblings of written pages current. A changed page
+    is compressed in a worker thread; an unchanged one only if a sibling is
+    missing. Siblings in encodings not asked for are removed from changed
+    pages, so none is ever left stale."""
+
+    def __init__(self, encodings=(), threads=None):
+        for encoding in encodings:
+            if not available(encoding): raise ValueError("cannot compress to %s: brotli is not installed" % (encoding))
+        self.encodings = list(encodings)
+        self.pages = 0
+        # per encoding, as an unchanged page may need only one sibling rewritten
+        self.page_bytes = {encoding: 0 for encoding in self.encodings}
+        self.compressed_bytes = {encoding: 0 for encoding in self.encodings}
+        self._executor = ThreadPoolExecutor(threads) if self.encodings else None
+        self._futures = []
+
+    def page_written(self, path, changed):
+        if changed:
+            encodings = self.encodings
+            for encoding in ENCODINGS:
+                if encoding not in encodings and os.path.exists(sibling_path(path, encoding)):
+                    os.remove(sibling_path(path, encoding))
+        else:
+            encodings = [encoding for encoding in self.encodings if not os.path.exists(sibling_path(path, encoding))]
+        if encodings:
+            self._futures.append(self._executor.submit(compress_file, path, encodings))
+        # collect as we go, so finished results are not held until close
+        while self._futures and self._futures[0].done():
+            self._record(self._futures.pop(0).result())
+
+    def _record(self, result):
+        (size, sizes) = result
+        self.pages += 1
+        for (encoding, compressed_size) in sizes.items():
+            self.page_bytes[encoding] += size
+            self.compressed_bytes[encoding] += compressed_size
+
+    def close(self):
+        """Wait for every page still compressing."""
+        for future in self._futures:
+            self._record(future.result())
+        self._futures = []
+        if self._executor: self._executor.shutdown()
+
+    def ratios(self):
+        """encoding -> compressed bytes as a fraction of the page bytes compressed."""
+        return {encoding: (compressed / self.page_bytes[encoding] if self.page_bytes[encoding] else 0.0)
+            for (encoding, compressed) in self.compressed_bytes.items()}
@@ -0,0 +1,71 @@
+import hashlib
+import json
+from datetime import datetime
+from sqlalchemy import Text, and_, cast, func, literal, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import aliased
+from springer.model import (
+    Classification, Contribution, Contributor, Edition, Equivalency, Identifier, PublicationFragment, Resource, Subject
+)
+from springer.model.bulk import upsert
+
+# Cached publication fragments for the OPDS export. A fragment's fingerprint
+# is computed in SQL from the rows opds_publication renders, so checking a
+# page against the cache costs two streamed queries and no ORM loading.
+
+# bump when opds_publication renders differently, to invalidate every fragment
+FRAGMENT_VERSION = 2
+
+def aggregated(expression, order_by, *where):
+    # newline-separated values of expression over the rows matching where, as one correlated scalar subquery
+    return select([func.string_agg(expression, aggregate_order_by(literal('\n'), order_by))]).\
+        where(and_(*where)).as_scalar()
+
+def fingerprint_column():
+    """md5 of everything opds_publication reads for an identifier and its edition."""
+    isbn = aliased(Identifier)
+    contributors = aggregated(Contributor.name + '|' + Contribution.role, Contribution.id,
+        Contribution.edition_id == Edition.id, Contributor.id == Contribution.contributor_id)
+    isbns = aggregated(isbn.type + '|' + isbn.identifier, isbn.identifier,
+        Equivalency.input_id == Identifier.id, isbn.id == Equivalency.output_id)
+    resources = aggregated(
+        Resource.url + '|' + func.coalesce(Resource.media_type, '') + '|' + func.coalesce(Resource.rel, ''),
+        Resource.id, Resource.identifier_id == Identifier.id)
+    subjects = aggregated(Subject.name, Classification.id,
+        Classification.identifier_id == Identifier.id, Subject.id == Classification.subject_id)
+    # json_build_array keeps nulls distinct from empty strings
+    return func.md5(cast(func.json_build_array(
+        FRAGMENT_VERSION, Identifier.identifier, Edition.title, Edition.language, Edition.description,
+        Edition.publisher, Edition.published, Edition.modified, contributors, isbns, resources, subjects
+    ), Text))
+
+def page_fingerprints(q, subject_index=None):
+    """Yield (identifier id, fingerprint, cached fingerprint or None) for the
+    identifiers of q, an id-ordered page query, from one statement."""
+    rows = q.with_entities(Identifier.id, Identifier.identifier, fingerprint_column(), PublicationFragment.fingerprint).\
+        join(Edition, Edition.primary_identifier_id == Identifier.id).\
+        outerjoin(PublicationFragment, PublicationFragment.identifier_id == Identifier.id).\
+        order_by(Edition.id)
+    previous = None
+    for (identifier_id, doi, fingerprint, cached) in rows:
+        # the feed renders an identifier's first edition only
+        if identifier_id == previous: continue
+        previous = identifier_id
+        if subject_index:
+            # subjects then come from the index rather than the classifications hashed above
+            subjects = json.dumps(subject_index.subjects(doi))
+            fingerprint = hashlib.md5((fingerprint + subjects).encode('utf-8')).hexdigest()
+        yield (identifier_id, fingerprint, cached)
+
+def page_fragments(q):
+    """(identifier id, DOI, cached fragment or None) for the identifiers of q, an id-ordered page query."""
+    return q.with_entities(Identifier.id, Identifier.identifier, PublicationFragment.fragment).\
+        outerjoin(PublicationFragment, PublicationFragment.identifier_id == Identifier.id)
+
+def store_fragments(db, fragments):
+    """Cache {identifier id: (fingerprint, fragment)} in one upsert."""
+    now = datetime.utcnow()
+    upsert(db, PublicationFragment, [
+        dict(identifier_id=identifier_id, fingerprint=fingerprint, fragment=fragment, updated=now)
+        for (identifier_id, (fingerprint, fragment)) in sorted(fragments.items())
+    ], ['identifier_id'], ['fingerprint', 'fragment', 'updated'])
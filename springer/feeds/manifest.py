@@ -0,0 +1,59 @@
+import json
+import os
+
+class FeedManifest(object):
+    """Content hashes of the feed pages in an output directory, persisted as JSON.
+    Pages are keyed by page number, or by any other string naming a page.
+
+    Each page entry records the SHA-256 of the page file, its size in bytes
+    and a short hash of every publication on it keyed by DOI, so a rebuild can
+    leave unchanged pages untouched and report which publications changed.
+    The paging of the last full export is kept as well, so a single page
+    can be regenerated to fit it without paging the whole catalogue again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pages = {}
+        self.paging = None
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.pages = data.get('pages', {})
+            self.paging = data.get('paging')
+
+    def entry(self, page_number):
+        return self.pages.get(str(page_number))
+
+    def digest(self, page_number):
+        return (self.entry(page_number) or {}).get('sha256')
+
+    def digests(self):
+        return {page: entry['sha256'] for (page, entry) in self.pages.items()}
+
+    def record(self, page_number, digest, size, publications):
+        """Replace a page's entry; returns how many of its publications are new or changed."""
+        previous = (self.entry(page_number) or {}).get('publications', {})
+        self.pages[str(page_number)] = dict(sha256=digest, bytes=size, publications=publications)
+        return len([key for (key, value) in publications.items() if previous.get(key) != value])
+
+    def prune(self, total_pages):
+        """Forget pages past total_pages; returns their page numbers."""
+        removed = sorted(int(page_number) for page_number in self.pages if int(page_number) > total_pages)
+        for page_number in removed:
+            del self.pages[str(page_number)]
+        return removed
+
+    def retain(self, pages):
+        """Forget every page not in pages; returns the forgotten ones."""
+        keep = {str(page) for page in pages}
+        removed = sorted(page for page in self.pages if page not in keep)
+        for page in removed:
+            del self.pages[page]
+        return removed
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(pages=self.pages, paging=self.paging), f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import re
+
+# Streams an OPDS 2 feed page to disk: the envelope first, then each
+# publication as it is rendered, so only one publication is held in memory.
+
+COMPACT = (',', ':')
+PUBLICATIONS = re.compile(r'"publications":\s*\[')
+
+def serialize_publication(publication, pretty=False):
+    """A publication serialized as FeedWriter places it in the publications array."""
+    if not pretty: return json.dumps(publication, separators=COMPACT)
+    return json.dumps(publication, indent=2).replace('\n', '\n    ')
+
+def publication_digest(text):
+    # short: the feed manifest keeps one per publication
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+def written_publications(path, chunk_size=64 * 1024):
+    """Yield each publication of a page FeedWriter wrote to path, as the text it
+    was written with, reading the file chunk_size characters at a time."""
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as f:
+        buffer = ''
+        position = None
+        while True:
+            chunk = f.read(chunk_size)
+            buffer += chunk
+            if position == None:
+                match = PUBLICATIONS.search(buffer)
+                if match == None and chunk: continue
+                if match == None: raise ValueError("%s has no publications array" % path)
+                position = match.end()
+            while True:
+                # the separator, and in pretty output the indent, before the next publication
+                while position < len(buffer) and buffer[position] in ',\n ': position += 1
+                if position == len(buffer) or buffer[position] == ']': break
+                try:
+                    (publication, end) = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    # cut off at the end of the chunk
+                    break
+                yield buffer[position:end]
+                position = end
+            if position < len(buffer) and buffer[position] == ']': return
+            if not chunk: raise ValueError("%s ends inside its publications" % path)
+            (buffer, position) = (buffer[position:], 0)
+
+class FeedWriter(object):
+    """Write one feed page to path. Output is compact by default; pretty
+    output matches json.dump(page, f, indent=2) byte for byte. The page is
+    written to a temporary file and moved into place when it is closed,
+    unless its SHA-256 equals previous_digest and the file is already there:
+    then the existing file is left untouched and changed is False."""
+
+    def __init__(self, path, pretty=False, previous_digest=None):
+        self.path = path
+        self.pretty = pretty
+        self.previous_digest = previous_digest
+        self.count = 0
+        self.size = 0
+        self.digest = None
+        self.changed = None
+        self.publication_digests = {}
+        self._sha256 = hashlib.sha256()
+        self._tmp_path = path + '.tmp'
+        self._file = open(self._tmp_path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type == None:
+            self.close()
+        else:
+            self.abort()
+
+    def _write(self, text):
+        data = text.encode('utf-8')
+        self._sha256.update(data)
+        self.size += len(data)
+        self._file.write(data)
+
+    def serialize(self, publication):
+        return serialize_publication(publication, self.pretty)
+
+    def begin(self, envelope):
+        """Write everything in envelope except its publications, which follow as they are written."""
+        envelope = {key: value for (key, value) in envelope.items() if key != 'publications'}
+        if self.pretty:
+            head = json.dumps(envelope, indent=2)[:-2] + ',\n  "publications": ['
+        else:
+            head = json.dumps(envelope, separators=COMPACT)[:-1] + ',"publications":['
+        self._write(head)
+
+    def publication(self, publication, key=None):
+        self.serialized(self.serialize(publication), key)
+
+    def serialized(self, text, key=None):
+        """Write a publication already serialized by serialize(), recording its digest under key."""
+        if self.pretty:
+            self._write((',\n    ' if self.count else '\n    ') + text)
+        else:
+            self._write((',' if self.count else '') + text)
+        if key != None: self.publication_digests[key] = publication_digest(text)
+        self.count += 1
+
+    def close(self):
+        if self.pretty:
+            self._write('\n  ]\n}' if self.count else ']\n}')
+        else:
+            self._write(']}')
+        self._file.close()
+        self.digest = self._sha256.hexdigest()
+        self.changed = (self.digest != self.previous_digest) or not os.path.exists(self.path)
+        if self.changed:
+            os.replace(self._tmp_path, self.path)
+        else:
+            os.remove(self._tmp_path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._tmp_path)
@@ -1,3 +1,4 @@
+import logging
 import warnings
 
 from sqlalchemy import create_engine
@@ -177,3 +178,5 @@ from .classification import Classification, Genre, Subject, IdentifierGenre
 from .contribution import Contribution, Contributor
 from .edition import Edition
 from .resource import Resource
+from .fingerprint import RecordFingerprint
+from .fragment import PublicationFragment
@@ -0,0 +1,49 @@
+# encoding: utf-8
+# Multi-row INSERT ... ON CONFLICT helpers for bulk loaders (PostgreSQL)
+
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+def insert_ignore(db, model, rows, returning=None):
+    """Insert rows in one statement, skipping any that violate a unique constraint.
+
+    :param returning: columns to return for the rows actually inserted
+    :return: list of returned rows, or None
+    """
+    if not rows: return [] if returning else None
+    stmt = insert(model.__table__).values(rows).on_conflict_do_nothing()
+    if returning:
+        return db.execute(stmt.returning(*returning)).fetchall()
+    db.execute(stmt)
+
+def upsert(db, model, rows, index_elements, update_columns):
+    """Insert rows in one statement, updating update_columns where index_elements conflict.
+    Rows must be unique on index_elements."""
+    if not rows: return
+    stmt = insert(model.__table__).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={column: getattr(stmt.excluded, column) for column in update_columns}
+    )
+    db.execute(stmt)
+
+def ids_by(db, model, key_columns, keys, constraint=None):
+    """Map natural keys to primary keys in one query.
+
+    :param key_columns: column names making up the natural key
+    :param keys: tuples of key values, or plain values for a single column
+    :return: dict of key (tuple, or value for a single column) -> lowest matching id
+    """
+    keys = list(set(keys))
+    if not keys: return {}
+    columns = [getattr(model, name) for name in key_columns]
+    q = select([func.min(model.id)] + columns).group_by(*columns)
+    if len(columns) == 1:
+        q = q.where(columns[0].in_(keys))
+    else:
+        q = q.where(tuple_(*columns).in_(keys))
+    if constraint is not None:
+        q = q.where(constraint)
+    if len(columns) == 1:
+        return {row[1]: row[0] for row in db.execute(q)}
+    return {tuple(row[1:]): row[0] for row in db.execute(q)}
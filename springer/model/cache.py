@@ -0,0 +1,106 @@
+# encoding: utf-8
+# In-process natural key -> primary key caches for frequently repeated lookups
+
+from collections import OrderedDict
+from sqlalchemy import select
+
+from . import get_one, get_one_or_create
+from .classification import Genre, Subject
+from .contribution import Contributor
+from .datasource import DataSource
+from .identifier import Identifier
+
+class IdentityCache(object):
+    """A bounded LRU map from a model's natural key to its primary key.
+
+    Keys are the value of a single key column, or a tuple of values for
+    several. Ids created inside a transaction that is later rolled back
+    stay cached; call clear() after a rollback.
+    """
+
+    def __init__(self, model, key_columns, maxsize=100000):
+        self.model = model
+        self.key_columns = tuple(key_columns)
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._ids = OrderedDict()
+
+    def key(self, **find_with):
+        if len(self.key_columns) == 1: return find_with[self.key_columns[0]]
+        return tuple(find_with[column] for column in self.key_columns)
+
+    def get(self, key):
+        if key in self._ids:
+            self.hits += 1
+            self._ids.move_to_end(key)
+            return self._ids[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, id):
+        self._ids[key] = id
+        self._ids.move_to_end(key)
+        while len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+
+    def update(self, ids):
+        for (key, id) in ids.items():
+            self.put(key, id)
+
+    def lookup_many(self, keys):
+        """Split keys into a dict of cached ids and a list of keys to query for."""
+        found = {}
+        missing = []
+        for key in set(keys):
+            id = self.get(key)
+            if id is None:
+                missing.append(key)
+            else:
+                found[key] = id
+        return (found, missing)
+
+    def id_for(self, db, autocreate=True, **find_with):
+        """Like get_one_or_create, but returns (id, new) and skips the
+        database when the natural key has been seen before."""
+        key = self.key(**find_with)
+        id = self.get(key)
+        if id is not None: return (id, False)
+        if autocreate:
+            (obj, new) = get_one_or_create(db, self.model, **find_with)
+        else:
+            (obj, new) = (get_one(db, self.model, **find_with), False)
+            if obj is None: return (None, False)
+        self.put(key, obj.id)
+        return (obj.id, new)
+
+    def warm(self, db):
+        """Load up to maxsize of the most recently created keys in one query."""
+        columns = [getattr(self.model, column) for column in self.key_columns]
+        q = select([self.model.id] + columns).order_by(self.model.id.desc()).limit(self.maxsize)
+        rows = db.execute(q).fetchall()
+        for row in reversed(rows):
+            self.put(row[1] if len(columns) == 1 else tuple(row[1:]), row[0])
+        return len(rows)
+
+    def clear(self):
+        self._ids.clear()
+
+    def stats(self):
+        return "%s: %s hits, %s misses, %s cached" % (
+            self.model.__name__, str(self.hits), str(self.misses), str(len(self._ids)))
+
+contributor_ids = IdentityCache(Contributor, ('name',))
+identifier_ids = IdentityCache(Identifier, ('type', 'identifier'))
+subject_ids = IdentityCache(Subject, ('name',))
+data_source_ids = IdentityCache(DataSource, ('name',), maxsize=100)
+genre_ids = IdentityCache(Genre, ('name',), maxsize=1000)
+
+IDENTITY_CACHES = (contributor_ids, identifier_ids, subject_ids, data_source_ids, genre_ids)
+
+def warm_caches(db, caches=IDENTITY_CACHES):
+    for cache in caches:
+        cache.warm(db)
+
+def cache_stats(caches=IDENTITY_CACHES):
+    return [cache.stats() for cache in caches]
@@ -1,7 +1,9 @@
 # encoding: utf-8
 # Subject, Classification
 
-from . import Base, Identifier
+import logging
+
+from . import Base, Identifier, get_one, get_one_or_create
 from sqlalchemy import Column, ForeignKey, Integer, String, Table, UniqueConstraint
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm import relationship
@@ -62,4 +64,14 @@ class Genre(Base):
                     return None, False
             return genre, new
 
-        return create()
+        if not use_cache:
+            return create()
+        from .cache import genre_ids
+        genre_id = genre_ids.get(name)
+        if genre_id is not None:
+            # served from the session's identity map when already loaded
+            return _db.query(Genre).get(genre_id), False
+        genre, new = create()
+        if genre is not None:
+            genre_ids.put(name, genre.id)
+        return genre, new
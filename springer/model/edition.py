@@ -2,7 +2,7 @@
 # Subject, Classification
 
 from . import Base
-from sqlalchemy import Column, Date, Enum, ForeignKey, Integer, String, UniqueConstraint
+from sqlalchemy import Column, Date, DateTime, Enum, ForeignKey, Integer, String, UniqueConstraint
 from sqlalchemy.orm import relationship
 
 # abbreviated from ThePalaceProject/circulation
@@ -44,7 +44,7 @@ class Edition(Base, EditionConstants):
 
     title = Column(String(512), index=True)
 
-    contributions = relationship("Contribution", backref="edition")
+    contributions = relationship("Contribution", backref="edition", order_by="Contribution.id")
 
     language = Column(String(16), index=True)
     publisher = Column(String(128), index=True)
@@ -59,3 +59,7 @@ class Edition(Base, EditionConstants):
 
     cover_full_url = Column(String(1024))
     cover_thumbnail_url = Column(String(1024))
+
+    # when the loader last saw this edition's crawl record change; databases
+    # created before this column need: ALTER TABLE editions ADD COLUMN modified TIMESTAMP
+    modified = Column(DateTime)
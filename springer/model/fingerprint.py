@@ -0,0 +1,14 @@
+# encoding: utf-8
+# RecordFingerprint
+
+from . import Base
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+
+class RecordFingerprint(Base):
+    """A hash of the normalized crawl record last loaded for a DOI, so an
+    unchanged record can be skipped on the next load."""
+
+    __tablename__ = "record_fingerprints"
+    identifier_id = Column(Integer, ForeignKey("identifiers.id"), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    updated = Column(DateTime)
@@ -0,0 +1,16 @@
+# encoding: utf-8
+# PublicationFragment
+
+from . import Base
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Text
+
+class PublicationFragment(Base):
+    """An identifier's OPDS publication serialized as compact JSON, with a
+    hash of the rows it was rendered from, so a feed export can reuse it
+    while those rows are unchanged."""
+
+    __tablename__ = "publication_fragments"
+    identifier_id = Column(Integer, ForeignKey("identifiers.id"), primary_key=True)
+    fingerprint = Column(String(32), nullable=False)
+    fragment = Column(Text, nullable=False)
+    updated = Column(DateTime)
@@ -27,12 +27,16 @@ class Identifier(Base):
     id = Column(Integer, primary_key=True)
     type = Column(String(64))
     identifier = Column(String(64))
-    classifications = relationship("Classification", back_populates="identifier", cascade="all, delete-orphan")
-    resources = relationship("Resource", back_populates="identifier", cascade="all, delete-orphan")
-    editions = relationship("Edition", back_populates="primary_identifier")
+    # collections are ordered so that rendered feeds are stable from run to run
+    classifications = relationship("Classification", back_populates="identifier", cascade="all, delete-orphan",
+        order_by="Classification.id")
+    resources = relationship("Resource", back_populates="identifier", cascade="all, delete-orphan",
+        order_by="Resource.id")
+    editions = relationship("Edition", back_populates="primary_identifier", order_by="Edition.id")
     equivalent_identifiers = relationship("Identifier",
         secondary="equivalents",
         primaryjoin=id==Equivalency.input_id,
-        secondaryjoin=id==Equivalency.output_id
+        secondaryjoin=id==Equivalency.output_id,
+        order_by=identifier
     )
     __table_args__ = (UniqueConstraint("type", "identifier"),)
@@ -1,35 +1,25 @@
-from .. import blank_string
 from configparser import ConfigParser
 import csv
-import json
 import os
-import importlib.util
-import sys
 
 MY_PATH = os.path.dirname(__file__)
 config_path = os.path.join(MY_PATH, '..', '..', "config.ini")
 config = ConfigParser()
 config.read(config_path)
 
-def pickle_utils():
-    rel_path = os.path.join(MY_PATH, "..","..","dcps","pickle_utils.py")
-    spec = importlib.util.spec_from_file_location("dcps.pickle_utils", rel_path)
-    m = importlib.util.module_from_spec(spec)
-    sys.modules["dcps.pickle_utils"] = m
-    spec.loader.exec_module(m)
-    return m
+def subjects_index_path():
+    return config['CSV'].get('subjectsIndex', os.path.join(
+        MY_PATH, '..', '..', 'output_test/springer/springer_subjects.idx'))
 
 def main():
+    from .index import build_index
     csv_path = config['CSV']['springer_subjects']
     with open(csv_path, newline='') as csvfile:
         csv_reader = csv.reader(csvfile, delimiter=',', quotechar='"')
-        out_path = os.path.join(
-            MY_PATH, '..', '..', 'output_test/springer/springer_subjects.pickle')
-        subject_data = get_subjects_dict(csv_reader)
-
-        print(pickle_utils().pickle_it(subject_data, out_path))
-
-    quit()
+        out_path = subjects_index_path()
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        (num_dois, num_subjects) = build_index(csv_reader, out_path)
+        print("indexed %s subjects for %s DOIs in %s" % (str(num_subjects), str(num_dois), out_path))
 
 
 def get_subjects_dict(csv_reader, head_row=True):
@@ -45,25 +35,7 @@ def get_subjects_dict(csv_reader, head_row=True):
         doi = row[0]
         subjects = [row[x + 1] for x in range(len(row) - 1)]
         subject_data[doi] = subjects
-
-
-def generate_subjects(csv_reader, head_row=True):
-    if head_row:
-        csv_reader.__next__()
-    for row in csv_reader:
-        doi = row[0]
-        subject_data = {
-            'doi': doi,
-            'name': row[1],
-            'primary': True
-        }
-        yield subject_data
-        subject_data['primary'] = False
-        subjects = [row[x + 2] for x in range(len(row) - 2)]
-        for subject in subjects:
-            if blank_string(subject): continue
-            subject_data['name'] = subject
-            yield subject_data
+    return subject_data
 
 
 if __name__ == "__main__":
@@ -0,0 +1,146 @@
+from array import array
+import mmap
+import os
+import struct
+import sys
+from .rows import generate_subjects
+
+# A memory-mapped DOI -> subjects index built from the Springer subjects CSV.
+#
+# Layout, all integers native uint32:
+#   header      magic, byte order mark, DOI count, subject count, cell count
+#   names       offsets[subjects + 1] into a UTF-8 blob of interned subject names
+#   dois        offsets[dois + 1] into a UTF-8 blob of DOIs in byte order
+#   cells       offsets[dois + 1] into a flat array of subject ids, primary flagged
+# Blobs are padded to four bytes so every array starts aligned.
+
+MAGIC = b'SUBJIDX1'
+BYTE_ORDER_MARK = 0x01020304
+HEADER = struct.Struct('=8sIIII')
+PRIMARY = 0x80000000
+
+def pad(blob):
+    return blob + b'\0' * (-len(blob) % 4)
+
+def offsets_of(blobs):
+    offsets = array('I', [0])
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    return offsets
+
+def build_index(csv_reader, out_path, head_row=True):
+    """Write the index for a subjects CSV; returns (DOIs, subjects).
+    Cells for a DOI repeated across rows are merged, the later flag winning."""
+    names = {}
+    subjects_by_doi = {}
+    for csv_subject in generate_subjects(csv_reader, head_row):
+        (doi, name, primary) = (csv_subject['doi'], csv_subject['name'], csv_subject['primary'])
+        if (not doi) or (not name.strip()): continue
+        subject_id = names.setdefault(name, len(names))
+        subjects_by_doi.setdefault(doi.encode('utf-8'), {})[subject_id] = primary
+    dois = sorted(subjects_by_doi)
+    cells = array('I')
+    cell_offsets = array('I', [0])
+    for doi in dois:
+        # primary subject first, then the rest in CSV order
+        for (subject_id, primary) in sorted(subjects_by_doi[doi].items(), key=lambda item: not item[1]):
+            cells.append(subject_id | PRIMARY if primary else subject_id)
+        cell_offsets.append(len(cells))
+    name_blobs = [name.encode('utf-8') for name in names]
+    tmp_path = out_path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, BYTE_ORDER_MARK, len(dois), len(names), len(cells)))
+        for (blobs, offsets) in ((name_blobs, offsets_of(name_blobs)), (dois, offsets_of(dois))):
+            out.write(offsets.tobytes())
+            out.write(pad(b''.join(blobs)))
+        out.write(cell_offsets.tobytes())
+        out.write(cells.tobytes())
+    os.replace(tmp_path, out_path)
+    return (len(dois), len(names))
+
+class SubjectIndex(object):
+    """Read-only view of an index file. Lookups binary search the mapped DOI
+    table, so only the pages they touch are read from disk."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, mark, self.doi_count, self.subject_count, cell_count) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC: raise ValueError("%s is not a subject index" % (path))
+        if mark != BYTE_ORDER_MARK: raise ValueError("%s was built on a machine of another byte order" % (path))
+        view = memoryview(self._mmap)
+        position = HEADER.size
+        (self._name_offsets, self._names, position) = self._table(view, position, self.subject_count)
+        (self._doi_offsets, self._dois, position) = self._table(view, position, self.doi_count)
+        self._cell_offsets = view[position:position + 4 * (self.doi_count + 1)].cast('I')
+        position += 4 * (self.doi_count + 1)
+        self._cells = view[position:position + 4 * cell_count].cast('I')
+        self._name_cache = {}
+
+    def _table(self, view, position, count):
+        offsets = view[position:position + 4 * (count + 1)].cast('I')
+        position += 4 * (count + 1)
+        blob_start = position
+        position += offsets[count] + (-offsets[count] % 4)
+        return (offsets, view[blob_start:position], position)
+
+    def __len__(self):
+        return self.doi_count
+
+    def __contains__(self, doi):
+        return self._find(doi) != None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for view in (self._name_offsets, self._names, self._doi_offsets, self._dois, self._cell_offsets, self._cells):
+            view.release()
+        self._mmap.close()
+
+    def _doi(self, position):
+        return self._dois[self._doi_offsets[position]:self._doi_offsets[position + 1]].tobytes()
+
+    def _find(self, doi):
+        key = doi.encode('utf-8')
+        (low, high) = (0, self.doi_count)
+        while low < high:
+            middle = (low + high) // 2
+            if self._doi(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.doi_count and self._doi(low) == key: return low
+        return None
+
+    def subject_name(self, subject_id):
+        if subject_id not in self._name_cache:
+            blob = self._names[self._name_offsets[subject_id]:self._name_offsets[subject_id + 1]]
+            self._name_cache[subject_id] = blob.tobytes().decode('utf-8')
+        return self._name_cache[subject_id]
+
+    def classifications(self, doi):
+        """(subject name, primary) for each subject of doi, primary first; [] if unknown."""
+        position = self._find(doi)
+        if position == None: return []
+        return [(self.subject_name(cell & ~PRIMARY), bool(cell & PRIMARY))
+            for cell in self._cells[self._cell_offsets[position]:self._cell_offsets[position + 1]]]
+
+    def subjects(self, doi):
+        return [name for (name, primary) in self.classifications(doi)]
+
+    def dois(self):
+        for position in range(self.doi_count):
+            yield self._doi(position).decode('utf-8')
+
+def main():
+    # print the subjects of each DOI given after the index path
+    with SubjectIndex(sys.argv[1]) as index:
+        for doi in sys.argv[2:]:
+            print("%s\t%s" % (doi, '; '.join(index.subjects(doi))))
+
+if __name__ == "__main__":
+    main()
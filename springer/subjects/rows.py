@@ -0,0 +1,19 @@
+from ..util import blank_string
+
+def generate_subjects(csv_reader, head_row=True):
+    if head_row:
+        csv_reader.__next__()
+    for row in csv_reader:
+        doi = row[0]
+        subject_data = {
+            'doi': doi,
+            'name': row[1],
+            'primary': True
+        }
+        yield subject_data
+        subject_data['primary'] = False
+        subjects = [row[x + 2] for x in range(len(row) - 2)]
+        for subject in subjects:
+            if blank_string(subject): continue
+            subject_data['name'] = subject
+            yield subject_data
@@ -0,0 +1,7 @@
+# Helpers with no database dependency, importable by standalone tools.
+
+def blank_string(val):
+	return (val == None) or (str(val).rstrip() == '')
+
+def blank_value(val):
+	return (val == {}) or (val == []) or (blank_string(val))
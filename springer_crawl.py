@@ -1,12 +1,20 @@
 # Generate OPDS v2.0 JSON from API output
+import argparse
+import calendar
 import json
 import os
 import re
 import requests
-import sys
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from configparser import ConfigParser
-from dcps.pickle_utils import unpickle_it
+from crawl.manifest import CrawlManifest
+from crawl.ratelimit import TokenBucket
+from crawl.store import SegmentStore
+from requests.adapters import HTTPAdapter
+from springer.util import blank_string
+from urllib.parse import quote
 
 MY_NAME = __file__
 MY_PATH = os.path.dirname(__file__)
@@ -16,10 +24,30 @@ config = ConfigParser()
 config.read(config_path)
 
 
-API_ENDPOINT = 'https://api.springernature.com/bookmeta/v1/json'
-API_KEY = config["SPRINGER"]["apiKey"]
-ENTITLEMENT_ID = config["API"]["entitlementID"]
+# SPRINGER_API_ENDPOINT or apiEndpoint can point the crawler at a stand-in (crawl/stand_in.py)
+API_ENDPOINT = os.environ.get('SPRINGER_API_ENDPOINT',
+    config.get("SPRINGER", "apiEndpoint", fallback='https://api.springernature.com/bookmeta/v1/json'))
+API_KEY = config.get("SPRINGER", "apiKey", fallback='')
+ENTITLEMENT_ID = config.get("API", "entitlementID", fallback=None)
 PER_PAGE = 100
+FULL_QUERY = 'sort:date'
+# record dates tracked for incremental crawls, with the API constraint that
+# selects records on or after a given value of each
+DATE_CONSTRAINTS = {'onlineDate': 'onlinedatefrom', 'publicationDate': 'datefrom'}
+# partitions larger than this many pages are split (year -> month -> day)
+# so no partition has to be paged deeply
+PARTITION_MAX_PAGES = 10
+REQUEST_TIMEOUT = 120
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 2.0
+# statuses worth retrying: quota throttling and upstream trouble
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# a range that still fails this way is refetched in halves, down to single
+# records, with fewer attempts per piece
+SPLIT_ERRORS = ('timeout', 'invalid', 'status:500', 'status:502', 'status:503', 'status:504')
+SPLIT_ATTEMPTS = 2
+# pages slower than this are listed in the problem report
+SLOW_PAGE_SECONDS = 30
 
 NOW = datetime.utcnow().strftime(
     "%Y-%m-%dT%H:%M:%S.%fZ")  # Current timestamp in ISO
@@ -33,63 +61,445 @@ def page_cache_path(page_number, output_base_dir):
   cache_name = 'page-%s.json' % cache_suffix
   return os.path.join(cache_dir, cache_name)
 
-def cache_page(page_number, output_base_dir):
+def page_url(query, start, per_page=PER_PAGE):
+    return '%s?q=%s&s=%s&p=%s&api_key=%s' % (API_ENDPOINT, quote(query, safe=':'), str(start), str(per_page), API_KEY)
+
+def cache_page(page_number, output_base_dir, limiter=None, session=None, manifest=None, query=FULL_QUERY,
+        store=None):
     start = (page_number - 1) * PER_PAGE + 1
-    out_file = page_cache_path(page_number, output_base_dir)
-    url = '%s?q=sort:date&s=%s&p=%s&api_key=%s' % (API_ENDPOINT, str(start), str(PER_PAGE), API_KEY)
-    page = springer_get(url)
-    with open(out_file, "w") as f:
-        json.dump(page, f, indent=2)
+    started = time.monotonic()
+    (page, stats) = fetch_range(query, start, PER_PAGE, limiter, session)
+    seconds = round(time.monotonic() - started, 3)
+    if page == None:
+        # never write a null page; the manifest marks it for --resume
+        if manifest: manifest.record(page_number, CrawlManifest.FAILED, attempts=stats['attempts'], seconds=seconds,
+            quarantined=stats['quarantined'])
+        return None
+    if store:
+        out_file = None
+        segment = store.append(page['records'])
+    else:
+        out_file = page_cache_path(page_number, output_base_dir)
+        segment = None
+        with open(out_file, "w") as f:
+            json.dump(page, f, indent=2)
+    if manifest:
+        manifest.observe(newest_dates(page['records']))
+        manifest.record(page_number, CrawlManifest.OK, records=count(page), size=stats['size'],
+            attempts=stats['attempts'], path=out_file, segment=segment, seconds=seconds,
+            splits=stats['splits'], quarantined=stats['quarantined'])
     return page
 
+def fetch_range(query, start, size, limiter=None, session=None, max_attempts=MAX_ATTEMPTS, depth=0):
+    """Fetch size records from start. A range that times out or errors is
+    refetched in halves, down to single records; single records that still
+    fail are quarantined by offset rather than failing the whole range.
+    Returns (page or None, stats). The page is None either because every
+    record in the range is quarantined, or because of an error that is not
+    the records' own, flagged in stats['failed'], which fails the whole range."""
+    (content, attempts, error) = springer_fetch(page_url(query, start, size), limiter, session, max_attempts)
+    stats = dict(attempts=attempts, size=len(content or b''), splits=0, quarantined=[], failed=False)
+    if content != None:
+        return (json.loads(content), stats)
+    # once splitting, a dropped connection is as likely to be the record as the API
+    if not (error in SPLIT_ERRORS or (depth > 0 and error == 'connection')):
+        stats['failed'] = True
+        return (None, stats)
+    if size == 1:
+        stats['quarantined'].append(start)
+        return (None, stats)
+    half = (size + 1) // 2
+    stats['splits'] = 1
+    page = None
+    for (piece_start, piece_size) in ((start, half), (start + half, size - half)):
+        (piece, piece_stats) = fetch_range(query, piece_start, piece_size, limiter, session, SPLIT_ATTEMPTS, depth + 1)
+        for key in ('attempts', 'size', 'splits', 'quarantined'):
+            stats[key] += piece_stats[key]
+        if piece_stats['failed']:
+            # dropping the piece would lose its records unnoticed; refetch the whole range later
+            stats['failed'] = True
+            return (None, stats)
+        # otherwise every record of a missing piece is quarantined
+        if piece == None: continue
+        if page == None:
+            page = piece
+        else:
+            page['records'].extend(piece['records'])
+        if piece_start + piece_size > int(result(piece)['total']): break
+    if page == None:
+        # every record in the range is quarantined
+        return (None, stats)
+    result(page)['start'] = str(start)
+    result(page)['pageLength'] = str(size)
+    result(page)['recordsDisplayed'] = str(len(page['records']))
+    return (page, stats)
+
 def result(page):
     return page["result"][0]
 
 def count(page):
     return int(result(page)["recordsDisplayed"])
 
-def remaining(page):
-    return int(result(page)["total"]) >= (int(result(page)["start"]) + PER_PAGE)
+def newest_dates(records):
+    newest = {}
+    for record in records:
+        for field in DATE_CONSTRAINTS:
+            value = record.get(field)
+            if blank_string(value): continue
+            if value > newest.get(field, ''): newest[field] = value
+    return newest
 
+def springer_session(pool_size=1):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
-def springer_get(url):
-    try:
-        print(url)
-        initial_page = requests.get(url)
-        initial_page.raise_for_status()
-    except Exception as err:
-        print('*** get_springer_count request error: ' + str(err))
-    else:
-        return json.loads(initial_page.content)
+def retry_delay(attempt, response=None):
+    # honor a server-supplied Retry-After, otherwise back off exponentially
+    if response is not None and response.headers.get('Retry-After', '').isdigit():
+        return int(response.headers['Retry-After'])
+    return BACKOFF_SECONDS * (2 ** (attempt - 1))
 
-def get_result_pages(springer_response):
-    total = int(result(springer_response)['total'])
+def springer_fetch(url, limiter=None, session=None, max_attempts=MAX_ATTEMPTS):
+    """Fetch url, retrying transient failures.
+    Returns (content or None, attempts, last error or None)"""
+    session = session or requests
+    error = None
+    for attempt in range(1, max_attempts + 1):
+        response = None
+        try:
+            if limiter: limiter.acquire()
+            print(url)
+            response = session.get(url, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            json.loads(response.content)
+            return (response.content, attempt, None)
+        except requests.HTTPError as err:
+            print('*** springer_fetch request error: ' + str(err))
+            error = 'status:%s' % (str(response.status_code))
+            if response.status_code not in RETRY_STATUSES: return (None, attempt, error)
+        except requests.Timeout as err:
+            print('*** springer_fetch request error: ' + str(err))
+            error = 'timeout'
+        except requests.ConnectionError as err:
+            print('*** springer_fetch request error: ' + str(err))
+            error = 'connection'
+        except ValueError as err:
+            print('*** springer_fetch request error: ' + str(err))
+            error = 'invalid'
+        if attempt < max_attempts:
+            time.sleep(retry_delay(attempt, response))
+    return (None, max_attempts, error)
+
+def pages_for_total(total):
     if (0 == total % PER_PAGE):
-        return total / PER_PAGE
+        return total // PER_PAGE
     else:
-        return 1 + total / PER_PAGE
+        return 1 + total // PER_PAGE
+
+def get_result_pages(springer_response):
+    return pages_for_total(int(result(springer_response)['total']))
+
+def report_throughput(pages, started):
+    elapsed = time.monotonic() - started
+    rate = (pages / elapsed) if elapsed > 0 else 0
+    print("Fetched %s pages in %.1fs (%.2f pages/s)." % (str(pages), elapsed, rate))
+
+def high_water_mark_path(output_base_dir):
+    return os.path.join(output_base_dir, 'high_water_mark.json')
+
+def load_high_water_mark(output_base_dir):
+    path = high_water_mark_path(output_base_dir)
+    if not os.path.exists(path): return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_high_water_mark(output_base_dir, newest):
+    # only ever advance: a delta window with nothing new must not move it back
+    marks = load_high_water_mark(output_base_dir)
+    for field, value in newest.items():
+        if value > marks.get(field, ''): marks[field] = value
+    marks['updated'] = NOW
+    with open(high_water_mark_path(output_base_dir), 'w') as f:
+        json.dump(marks, f, indent=2)
+    return marks
+
+def delta_query(marks, overlap_days):
+    for field, constraint in DATE_CONSTRAINTS.items():
+        if field in marks:
+            since = date.fromisoformat(marks[field]) - timedelta(days=overlap_days)
+            return '%s:%s %s' % (constraint, since.isoformat(), FULL_QUERY)
+    return None
+
+def append_crawl_log(crawl_log_path, manifest):
+    paths = [manifest.entry(ix)['path'] for ix in sorted(int(ix) for ix in manifest.pages)
+        if manifest.entry(ix)['status'] == CrawlManifest.OK and manifest.entry(ix).get('path')]
+    with open(crawl_log_path, 'a') as crawl_log:
+        for path in paths:
+            crawl_log.write(os.path.abspath(path) + '\n')
+    return len(paths)
 
-def springer_build_cache(output_base_dir):
-    if sys.argv[1]:
-        page_ix = int(sys.argv[1])
+def report_problems(manifest, limit=10):
+    # ranges that needed splitting, records left out, and the slowest pages
+    entries = sorted(manifest.pages.items(), key=lambda item: int(item[0]))
+    split = [ix for (ix, entry) in entries if entry.get('splits')]
+    quarantined = [(ix, start) for (ix, entry) in entries for start in entry.get('quarantined', [])]
+    slow = sorted(((entry.get('seconds', 0), ix) for (ix, entry) in entries
+        if entry.get('seconds', 0) >= SLOW_PAGE_SECONDS), reverse=True)
+    if split:
+        print("%s pages needed splitting: %s" % (str(len(split)), ", ".join(split[:limit])))
+    if quarantined:
+        print("%s records quarantined (page:offset): %s" % (str(len(quarantined)),
+            ", ".join("%s:%s" % (ix, str(start)) for (ix, start) in quarantined[:limit])))
+    if slow:
+        print("%s pages slower than %ss: %s" % (str(len(slow)), str(SLOW_PAGE_SECONDS),
+            ", ".join("%s (%.1fs, %s bytes)" % (ix, seconds, str(manifest.entry(ix).get('bytes')))
+                for (seconds, ix) in slow[:limit])))
+
+def springer_build_cache(output_base_dir, page_ix=1, limiter=None, concurrency=1, manifest=None, resume=False,
+        query=FULL_QUERY, session=None, store=None):
+    # the first page is fetched alone to learn the result total; the rest are
+    # spread over a thread pool whose size bounds the number of in-flight pages
+    started = time.monotonic()
+    session = session or springer_session(concurrency)
+    manifest = manifest or CrawlManifest(os.path.join(output_base_dir, 'manifest.json'))
+    total = 0
+    retrieved = 0
+    failed = []
+    if resume and manifest.total != None:
+        query = manifest.query or query
+        expected_pages = pages_for_total(manifest.total)
+        page_numbers = manifest.pending(range(page_ix, expected_pages + 1))
+        print("Resuming: %s of %s pages missing or failed." % (str(len(page_numbers)), str(expected_pages)))
     else:
-        page_ix = 1
-    page = cache_page(page_ix, output_base_dir)
-    total = count(page)
-    expected_pages = get_result_pages(page)
-    while remaining(page):
-        page_ix = page_ix + 1
-        page = cache_page(page_ix, output_base_dir)
-        total = total + count(page)
+        manifest.query = query
+        page = cache_page(page_ix, output_base_dir, limiter, session, manifest, query, store)
+        if page == None:
+            manifest.save()
+            print("Could not retrieve first page %s." % (str(page_ix)))
+            return False
+        manifest.total = int(result(page)['total'])
+        total = count(page)
+        retrieved = 1
+        expected_pages = get_result_pages(page)
+        page_numbers = range(page_ix + 1, expected_pages + 1)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pages = executor.map(lambda ix: cache_page(ix, output_base_dir, limiter, session, manifest, query, store),
+                page_numbers)
+            for ix, page in zip(page_numbers, pages):
+                if page == None:
+                    failed.append(ix)
+                    continue
+                retrieved = retrieved + 1
+                total = total + count(page)
+    finally:
+        if store: store.close()
+        manifest.save()
 
     print("Expected " + str(expected_pages) + " pages.")
-    print("Retrieved " + str(page_ix) + " pages.")
+    print("Retrieved " + str(retrieved) + " pages.")
     print("Retrieved " + str(total) + " books.")
+    if failed:
+        print("Failed " + str(len(failed)) + " pages: " + ", ".join(str(ix) for ix in failed))
+        print("Rerun with --resume to refetch them.")
+    report_problems(manifest)
+    report_throughput(retrieved + len(failed), started)
+    return not manifest.pending(range(1, expected_pages + 1))
+
+def unfinished_delta_dir(output_base_dir):
+    """The newest delta directory whose crawl has pages missing or failed, if any."""
+    base_dir = os.path.join(output_base_dir, 'delta')
+    if not os.path.isdir(base_dir): return None
+    for name in sorted(os.listdir(base_dir), reverse=True):
+        manifest_path = os.path.join(base_dir, name, 'manifest.json')
+        if not os.path.exists(manifest_path): continue
+        manifest = CrawlManifest(manifest_path)
+        if manifest.total == None or manifest.pending(range(1, pages_for_total(manifest.total) + 1)):
+            return os.path.join(base_dir, name)
+        # deltas finish in order, so everything older is finished too
+        return None
+    return None
+
+def springer_delta_crawl(output_base_dir, limiter=None, concurrency=1, overlap_days=7, segmented=False):
+    marks = load_high_water_mark(output_base_dir)
+    query = delta_query(marks, overlap_days)
+    if query == None:
+        print("No high-water mark in %s; run a full crawl first." % (high_water_mark_path(output_base_dir)))
+        return False
+    # an interrupted delta is resumed, with the window it started with, rather than begun again
+    delta_dir = unfinished_delta_dir(output_base_dir)
+    resume = delta_dir != None
+    if not resume:
+        delta_dir = os.path.join(output_base_dir, 'delta', datetime.utcnow().strftime("%Y%m%dT%H%M%S"))
+        os.makedirs(delta_dir, exist_ok=True)
+    manifest = CrawlManifest(os.path.join(delta_dir, 'manifest.json'))
+    query = manifest.query or query
+    print("%s %s into %s" % ("Resuming" if resume else "Crawling", query, delta_dir))
+    store = SegmentStore(os.path.join(delta_dir, 'store')) if segmented else None
+    complete = springer_build_cache(delta_dir, 1, limiter, concurrency, manifest, resume, query=query, store=store)
+    if not complete:
+        # leave the mark and crawl log alone so the next run covers this window again
+        return False
+    crawl_log_path = config.get("SPRINGER", "crawlLog", fallback=None)
+    if store:
+        print("Delta records are in %s" % (store.base_dir))
+    elif crawl_log_path:
+        appended = append_crawl_log(crawl_log_path, manifest)
+        print("Appended %s pages to %s" % (str(appended), crawl_log_path))
+    marks = save_high_water_mark(output_base_dir, manifest.newest)
+    print("High-water mark now %s" % (json.dumps(marks)))
+    return True
+
+def probe_total(query, limiter=None, session=None):
+    (content, attempts, error) = springer_fetch(page_url(query, 1, 1), limiter, session)
+    if content == None: return None
+    return int(result(json.loads(content))['total'])
+
+def partition_query(partition):
+    return 'datefrom:%s dateto:%s %s' % (partition['first'], partition['last'], FULL_QUERY)
+
+def date_partition(key, first, last):
+    return dict(key=key, first=first.isoformat(), last=last.isoformat())
+
+def split_partition(partition):
+    # a year splits into months, a month into days; a day cannot split further
+    first = date.fromisoformat(partition['first'])
+    if len(partition['key']) == 4:
+        return [date_partition('%04d-%02d' % (first.year, month), date(first.year, month, 1),
+            date(first.year, month, calendar.monthrange(first.year, month)[1])) for month in range(1, 13)]
+    if len(partition['key']) == 7:
+        return [date_partition(day.isoformat(), day, day) for day in
+            (first + timedelta(days=offset) for offset in range(calendar.monthrange(first.year, first.month)[1]))]
+    return None
+
+def plan_partitions(first_year, last_year, limiter=None, session=None, concurrency=1):
+    max_records = PARTITION_MAX_PAGES * PER_PAGE
+    level = [date_partition(str(year), date(year, 1, 1), date(year, 12, 31)) for year in range(first_year, last_year + 1)]
+    partitions = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while level:
+            totals = executor.map(lambda partition: probe_total(partition_query(partition), limiter, session), level)
+            next_level = []
+            for partition, total in zip(level, totals):
+                if total == None:
+                    raise RuntimeError("could not size partition %s" % (partition['key']))
+                if total == 0: continue
+                splits = split_partition(partition) if total > max_records else None
+                if splits:
+                    next_level.extend(splits)
+                    continue
+                if total > max_records:
+                    print("Partition %s still has %s records; it will be paged deeply." % (partition['key'], str(total)))
+                partition['total'] = total
+                partitions.append(partition)
+            level = next_level
+    return sorted(partitions, key=lambda partition: partition['key'])
+
+def springer_partitioned_crawl(output_base_dir, limiter=None, concurrency=1, first_year=1840, last_year=None,
+        resume=False, segmented=False):
+    # each date partition is its own shallow crawl with its own manifest;
+    # partitions run in parallel, each paged sequentially
+    started = time.monotonic()
+    partitions_dir = os.path.join(output_base_dir, 'partitions')
+    os.makedirs(partitions_dir, exist_ok=True)
+    plan_path = os.path.join(partitions_dir, 'plan.json')
+    session = springer_session(concurrency)
+    if resume and os.path.exists(plan_path):
+        with open(plan_path) as f:
+            plan = json.load(f)
+    else:
+        global_total = probe_total(FULL_QUERY, limiter, session)
+        if global_total == None:
+            print("Could not retrieve the global result total.")
+            return False
+        last_year = last_year or (date.today().year + 1)
+        plan = dict(total=global_total, partitions=plan_partitions(first_year, last_year, limiter, session, concurrency))
+        with open(plan_path, 'w') as f:
+            json.dump(plan, f, indent=2)
+    partitions = plan['partitions']
+    planned = sum(partition['total'] for partition in partitions)
+    print("%s partitions cover %s of %s records." % (str(len(partitions)), str(planned), str(plan['total'])))
+    if planned != plan['total']:
+        print("*** %s records fall outside the date partitions (undated or out of range)." % (str(plan['total'] - planned)))
+
+    def crawl_partition(partition):
+        partition_dir = os.path.join(partitions_dir, partition['key'])
+        manifest = CrawlManifest(os.path.join(partition_dir, 'manifest.json'))
+        store = SegmentStore(os.path.join(partition_dir, 'store')) if segmented else None
+        complete = springer_build_cache(partition_dir, 1, limiter, 1, manifest, resume, partition_query(partition), session,
+            store)
+        return (manifest, complete)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        crawled = list(executor.map(crawl_partition, partitions))
+
+    # reconcile what each partition returned against what it was sized at
+    retrieved = 0
+    mismatched = []
+    newest = {}
+    crawl_log_path = os.path.join(partitions_dir, 'crawl_log.txt')
+    open(crawl_log_path, 'w').close()
+    for partition, (manifest, complete) in zip(partitions, crawled):
+        records = sum(entry['records'] for entry in manifest.pages.values() if entry['status'] == CrawlManifest.OK)
+        retrieved += records
+        if (not complete) or records != partition['total']:
+            mismatched.append("%s (planned %s, retrieved %s)" % (partition['key'], str(partition['total']), str(records)))
+        for field, value in manifest.newest.items():
+            if value > newest.get(field, ''): newest[field] = value
+        append_crawl_log(crawl_log_path, manifest)
+    print("Retrieved %s of %s records across %s partitions." % (str(retrieved), str(plan['total']), str(len(partitions))))
+    if mismatched:
+        print("*** %s partitions do not reconcile; rerun with --resume or replan:" % (str(len(mismatched))))
+        for line in mismatched: print("  " + line)
+    if not segmented: print("Partition pages are listed in %s" % (crawl_log_path))
+    report_throughput(sum(len(manifest.pages) for (manifest, complete) in crawled), started)
+    if (not mismatched) and planned == plan['total']:
+        save_high_water_mark(output_base_dir, newest)
+        return True
+    return False
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Cache Springer bookmeta API result pages.")
+    parser.add_argument("start", nargs="?", type=int, default=1, help="first result page to fetch")
+    parser.add_argument("--concurrency", type=int, default=config.getint("SPRINGER", "concurrency", fallback=1),
+        help="number of pages in flight at once; 1 crawls sequentially")
+    parser.add_argument("--rate", type=float, default=config.getfloat("SPRINGER", "requestsPerSecond", fallback=0),
+        help="API requests per second allowed by the key quota; 0 is unlimited")
+    parser.add_argument("--burst", type=int, default=config.getint("SPRINGER", "requestBurst", fallback=1),
+        help="requests that may be issued back to back before the rate applies")
+    parser.add_argument("--resume", action="store_true",
+        help="refetch only pages the crawl manifest records as missing or failed")
+    parser.add_argument("--incremental", action="store_true",
+        help="crawl only records dated after the stored high-water mark, appending them to the crawl log")
+    parser.add_argument("--overlap-days", type=int, default=config.getint("SPRINGER", "deltaOverlapDays", fallback=7),
+        help="days before the high-water mark an incremental crawl reaches back")
+    parser.add_argument("--partitioned", action="store_true",
+        help="crawl independent publication date partitions in parallel instead of one deep result set")
+    parser.add_argument("--first-year", type=int, default=config.getint("SPRINGER", "firstYear", fallback=1840),
+        help="earliest publication year a partitioned crawl covers")
+    parser.add_argument("--segmented", action="store_true",
+        help="write records to compressed segment files under store/ instead of one JSON file per page")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
     output_base_dir = "output_test/springer/crawl"
     os.makedirs(output_base_dir, exist_ok=True)
-    springer_build_cache(output_base_dir)
+    limiter = TokenBucket(args.rate, args.burst)
+    if args.incremental:
+        springer_delta_crawl(output_base_dir, limiter, args.concurrency, args.overlap_days, args.segmented)
+        return
+    if args.partitioned:
+        springer_partitioned_crawl(output_base_dir, limiter, args.concurrency, args.first_year, resume=args.resume,
+            segmented=args.segmented)
+        return
+    manifest = CrawlManifest(os.path.join(output_base_dir, 'manifest.json'))
+    store = SegmentStore(os.path.join(output_base_dir, 'store')) if args.segmented else None
+    if springer_build_cache(output_base_dir, args.start, limiter, args.concurrency, manifest, args.resume, store=store):
+        save_high_water_mark(output_base_dir, manifest.newest)
 
 if __name__ == "__main__":
     main()
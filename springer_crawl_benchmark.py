@@ -0,0 +1,63 @@
+# Benchmark springer_crawl.py against the local API stand-in
+import argparse
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+import springer_crawl
+from crawl.manifest import CrawlManifest
+from crawl.ratelimit import TokenBucket
+from crawl.stand_in import StandIn, start_stand_in, synthetic_corpus
+
+def run_crawl(endpoint, concurrency, rate, burst):
+    output_base_dir = tempfile.mkdtemp(prefix='springer-crawl-bench-')
+    try:
+        springer_crawl.API_ENDPOINT = endpoint
+        manifest = CrawlManifest(os.path.join(output_base_dir, 'manifest.json'))
+        started = time.monotonic()
+        # the crawler prints every url it fetches; keep the report readable
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            springer_crawl.springer_build_cache(output_base_dir, 1, TokenBucket(rate, burst), concurrency, manifest)
+        elapsed = time.monotonic() - started
+        pages = len(manifest.pages)
+        return dict(
+            pages=pages,
+            failed=len(manifest.failed()),
+            records=sum(entry['records'] for entry in manifest.pages.values()),
+            retries=sum(entry['attempts'] for entry in manifest.pages.values()) - pages,
+            seconds=elapsed
+        )
+    finally:
+        shutil.rmtree(output_base_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Springer crawler against a local API stand-in.")
+    parser.add_argument("--records", type=int, default=20000, help="size of the synthetic corpus")
+    parser.add_argument("--concurrency", default="1,2,4,8,16", help="comma-separated concurrency settings to compare")
+    parser.add_argument("--rate", type=float, default=0, help="requests per second; 0 is unlimited")
+    parser.add_argument("--burst", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds added to every response")
+    parser.add_argument("--latency-per-record", type=float, default=0.002, help="seconds added per requested record")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.02, help="fraction of requests answered with 429")
+    parser.add_argument("--backoff", type=float, default=0.1, help="base retry backoff in seconds")
+    args = parser.parse_args()
+
+    springer_crawl.BACKOFF_SECONDS = args.backoff
+    corpus = synthetic_corpus(args.records)
+    print("concurrency  pages  failed  records  retries  requests  wall(s)  pages/s")
+    for concurrency in [int(value) for value in args.concurrency.split(',')]:
+        stand_in = StandIn(corpus, args.latency, args.latency_per_record, args.error_rate, args.throttle_rate)
+        (server, endpoint) = start_stand_in(stand_in)
+        try:
+            stats = run_crawl(endpoint, concurrency, args.rate, args.burst)
+        finally:
+            server.shutdown()
+            server.server_close()
+        print("%11d  %5d  %6d  %7d  %7d  %8d  %7.1f  %7.2f" % (concurrency, stats['pages'], stats['failed'],
+            stats['records'], stats['retries'], stand_in.counts['requests'], stats['seconds'],
+            stats['pages'] / stats['seconds']))
+
+if __name__ == "__main__":
+    main()
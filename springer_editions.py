@@ -1,12 +1,23 @@
+import argparse
+import gzip
+import hashlib
 import os
 import json
-from datetime import date
+import resource
+from collections import namedtuple
+from datetime import date, datetime
+from itertools import islice
+from multiprocessing import Pool
+from crawl.pages import iter_page_records
+from crawl.store import SegmentStore
 from springer import blank_string, config, db_session
-from springer.mappings import palace_language
+from springer.mappings import GENRES, normalized_genres, palace_language
 from springer.model import (
     SessionManager, Identifier, Genre, IdentifierGenre, Classification, Contribution, Contributor,
-    DataSource, Edition, Equivalency, Resource, create, get_one_or_create
+    DataSource, Edition, Equivalency, RecordFingerprint, Resource, create, get_one_or_create
 )
+from springer.model.bulk import ids_by, insert_ignore, upsert
+from springer.model.cache import cache_stats, contributor_ids, genre_ids, identifier_ids, warm_caches
 from sqlalchemy import *
 from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm.exc import NoResultFound
@@ -22,90 +33,268 @@ def edition_for_identifier(identifier):
 def stub_edition(data_source, identifier):
     return create(db_session, Edition, data_source_id=data_source.id, primary_identifier_id=identifier.id)
 
-def contributor_for_name(name):
-    find_with=dict(name=name)
-    create_with = dict()
-    (contributor, new) = get_one_or_create(
-        db_session, Contributor, create_method_kwargs=create_with, **find_with
-    )
-    return contributor
+def contributor_id_for_name(name):
+    (contributor_id, new) = contributor_ids.id_for(db_session, name=name)
+    return contributor_id
 
 def equate_identifier_to(data_source, primary_identifier, **find_with):
-    (equivalent, new) = get_one_or_create(
-        db_session, Identifier, **find_with
-    )
+    (equivalent_id, new) = identifier_ids.id_for(db_session, **find_with)
     (equivalency, new) = get_one_or_create(
-        db_session, Equivalency, input_id=primary_identifier.id, output_id=equivalent.id, data_source_id=data_source.id
+        db_session, Equivalency, input_id=primary_identifier.id, output_id=equivalent_id, data_source_id=data_source.id
     )
     return equivalency
 
-def update_edition(data_source, identifier, edition, edition_data):
+def genre_table(db):
+    """Create any genre named in the GENRES mapping that is missing and cache
+    the ids of all of them: one insert and one select per run."""
+    names = sorted({name for names in GENRES.values() for name in names})
+    insert_ignore(db, Genre, [dict(name=name) for name in names])
+    ids = ids_by(db, Genre, ('name',), names)
+    genre_ids.update(ids)
+    return ids
+
+def genre_ids_for(names):
+    (found, missing) = genre_ids.lookup_many(names)
+    if missing: found.update(genre_table(db_session))
+    return found
+
+def set_identifier_genres(genre_ids_by_identifier):
+    """Make the genres of each identifier id in genre_ids_by_identifier exactly
+    the given genre ids, with one select, one delete and one insert.
+    Returns (genres added, genres removed)."""
+    wanted = {(identifier_id, genre_id) for (identifier_id, genre_ids) in genre_ids_by_identifier.items()
+        for genre_id in genre_ids}
+    identifier_genres = IdentifierGenre.__table__
+    existing = set()
+    if genre_ids_by_identifier:
+        existing = {tuple(row) for row in db_session.execute(
+            select([identifier_genres.c.identifier_id, identifier_genres.c.genre_id]).
+                where(identifier_genres.c.identifier_id.in_(sorted(genre_ids_by_identifier)))
+        )}
+    stale = existing - wanted
+    if stale:
+        db_session.execute(identifier_genres.delete().where(
+            tuple_(identifier_genres.c.identifier_id, identifier_genres.c.genre_id).in_(sorted(stale))
+        ))
+    insert_ignore(db_session, IdentifierGenre, [
+        dict(identifier_id=identifier_id, genre_id=genre_id) for (identifier_id, genre_id) in sorted(wanted - existing)
+    ])
+    return (len(wanted - existing), len(stale))
+
+def edition_genres(edition_data):
+    # genre may be a single value or a list; resourceType is a single value
+    values = []
+    for field in ('resourceType', 'genre'):
+        value = edition_data.get(field) or []
+        values.extend(value if isinstance(value, list) else [value])
+    return unique(name for value in values for name in normalized_genres(value))
+
+# the plain values one crawl record maps to; shared by the per-record and bulk loaders
+EditionRow = namedtuple('EditionRow', [
+    'doi', 'title', 'language', 'publisher', 'published', 'description', 'contributions', 'isbns', 'resources',
+    'genres'
+])
+
+def normalize_edition(edition_data):
     # Contributions
     # creators/creator -> contributor and contribution(role='author')
     ## if more than one creator, first also contribution(role='primary author')
+    contributions = []
     for index, creator in enumerate(edition_data['creators']):
         if (blank_string(creator['creator'])): continue
-        contributor = contributor_for_name(creator['creator'])
         role = 'Primary Author' if (index == 0) else 'Author'
-        get_one_or_create(db_session, Contribution, contributor_id=contributor.id, edition_id=edition.id, role=role)
+        contributions.append((creator['creator'], role))
     # bookEditors/bookEditor -> contributor and contribution(role='editor')
     for editor in edition_data['bookEditors']:
         if (blank_string(editor['bookEditor'])): continue
-        contributor = contributor_for_name(editor['bookEditor'])
-        get_one_or_create(db_session, Contribution, contributor_id=contributor.id, edition_id=edition.id, role='Editor')
+        contributions.append((editor['bookEditor'], 'Editor'))
 
     # Identifier Equivalencies
     ## map isbn to identifer(type='ISBN'), and equivalent to doi
+    isbns = []
     if (not blank_string(edition_data['isbn'])):
-        equate_identifier_to(data_source, identifier, type='ISBN', identifier=edition_data['isbn'])
+        isbns.append(edition_data['isbn'])
     if (not blank_string(edition_data['printIsbn'])):
         if (edition_data['isbn'] != edition_data['printIsbn']):
-            equate_identifier_to(data_source, identifier, type='ISBN', identifier=edition_data['printIsbn'])
+            isbns.append(edition_data['printIsbn'])
     ## TODO/Lyrasis: EISBN is not a defined type in IdentifierConstants
     if (not blank_string(edition_data['electronicIsbn'])):
         if (edition_data['isbn'] != edition_data['electronicIsbn']):
-            equate_identifier_to(data_source, identifier, type='ISBN', identifier=edition_data['electronicIsbn'])
+            isbns.append(edition_data['electronicIsbn'])
 
     # Resources
     ## url is typically a list of objects, but can be a single object
     ## if url/format=pdf: add resource(url=url/value)
-    resources = edition_data['url'] if isinstance(edition_data['url'], list) else [edition_data['url']] 
-    for resource_data in resources:
+    resources = []
+    urls = edition_data['url'] if isinstance(edition_data['url'], list) else [edition_data['url']]
+    for resource_data in urls:
         if (resource_data['format'] == 'pdf'):
-            create_resource = dict(
-                data_source_id=data_source.id, identifier_id=identifier.id, url=resource_data['value'], media_type="application/pdf"
-            )
-            get_one_or_create(db_session, Resource, **create_resource)
-
+            resources.append((resource_data['value'], "application/pdf"))
     ## if ePubUrl: add resource(url=ePubUrl)
     if ('ePubUrl' in edition_data and not blank_string(edition_data['ePubUrl'])):
-        create_resource = dict(
-            data_source_id=data_source.id, identifier_id=identifier.id, url=edition_data['ePubUrl'], media_type="application/epub+zip"
-        )
-        get_one_or_create(db_session, Resource, **create_resource)
+        resources.append((edition_data['ePubUrl'], "application/epub+zip"))
 
-    # if language is present, map to Palace language
-    if (not blank_string(edition_data['language'])): edition.language = palace_language(edition_data['language']) 
+    # if language is present, it is mapped to Palace language when written;
+    # a language with no mapping then clears the edition's, as it always has
+    language = None
+    if (not blank_string(edition_data['language'])): language = edition_data['language']
     # if title is not blank prefer it over publicationName
+    title = None
     if (('publicationName' in edition_data) and (not blank_string(edition_data['publicationName']))):
-        edition.title = edition_data['publicationName']
+        title = edition_data['publicationName']
     if (('title' in edition_data) and (not blank_string(edition_data['title']))):
-        edition.title = edition_data['title']
-    # publisher maps to publisher
-    edition.publisher = edition_data['publisher']
-    # publicationDate maps to published
-    edition.published = date.fromisoformat(edition_data['publicationDate'])
+        title = edition_data['title']
     # if abstract map to description
-    if (not blank_string(edition_data['abstract'])): edition.description = edition_data['abstract']
-    # TODO/TBD: Genres are in Palace but not OPDS
-    ## map resourceType to genres
-    ## map genre to genres
-    ## build Genre and IdentifierGenres
+    description = None
+    if (not blank_string(edition_data['abstract'])): description = edition_data['abstract']
+    # Genres are in Palace but not OPDS
+    ## map resourceType and genre to normalized genres
     # TODO/TBD: if openaccess: ??? use different acquisition strategy?
     # TODO/TBD: if copyright: ???
+    return EditionRow(
+        doi=edition_data['doi'],
+        title=title,
+        language=language,
+        # publisher maps to publisher
+        publisher=edition_data['publisher'],
+        # publicationDate maps to published
+        published=date.fromisoformat(edition_data['publicationDate']),
+        description=description,
+        contributions=tuple(unique(contributions)),
+        isbns=tuple(unique(isbns)),
+        resources=tuple(unique(resources)),
+        genres=tuple(edition_genres(edition_data))
+    )
+
+def unique(values):
+    return list(dict.fromkeys(values))
+
+def edition_fingerprint(row):
+    return hashlib.sha256(json.dumps(row, default=str).encode('utf-8')).hexdigest()
+
+def stored_fingerprints(dois):
+    """Map each DOI with a recorded fingerprint to it, in one query."""
+    if not dois: return {}
+    q = select([Identifier.identifier, RecordFingerprint.fingerprint]).\
+        select_from(Identifier.__table__.join(RecordFingerprint.__table__)).\
+        where(Identifier.type == 'DOI').\
+        where(Identifier.identifier.in_(list(dois)))
+    return dict(db_session.execute(q).fetchall())
+
+def update_edition(data_source, identifier, edition, edition_data):
+    # blank title, language and description leave the edition's values alone
+    row = normalize_edition(edition_data)
+    for (name, role) in row.contributions:
+        contributor_id = contributor_id_for_name(name)
+        get_one_or_create(db_session, Contribution, contributor_id=contributor_id, edition_id=edition.id, role=role)
+    for isbn in row.isbns:
+        equate_identifier_to(data_source, identifier, type='ISBN', identifier=isbn)
+    for (url, media_type) in row.resources:
+        create_resource = dict(
+            data_source_id=data_source.id, identifier_id=identifier.id, url=url, media_type=media_type
+        )
+        get_one_or_create(db_session, Resource, **create_resource)
+    genres = genre_ids_for(row.genres)
+    set_identifier_genres({identifier.id: [genres[name] for name in row.genres]})
+    if (row.language): edition.language = palace_language(row.language)
+    if (row.title): edition.title = row.title
+    edition.publisher = row.publisher
+    edition.published = row.published
+    if (row.description): edition.description = row.description
     return edition
 
-def load_edition(data_source, edition_data):
+def bulk_load_editions(data_source, rows, force=False):
+    """Write a page of EditionRows with one multi-row statement per table,
+    resolving generated ids with one query per table. Produces the same rows
+    as load_edition. Rows whose fingerprint is unchanged are skipped unless
+    force is set. Returns (new DOI identifiers, skipped rows)."""
+    rows = list({row.doi: row for row in rows}.values())
+    fingerprints = {row.doi: edition_fingerprint(row) for row in rows}
+    stored = stored_fingerprints(fingerprints.keys())
+    changed = {doi for (doi, fingerprint) in fingerprints.items() if stored.get(doi) != fingerprint}
+    skipped = 0
+    if not force:
+        skipped = len(rows) - len(changed)
+        rows = [row for row in rows if row.doi in changed]
+    if not rows: return (0, skipped)
+    now = datetime.utcnow()
+    new_identifiers = insert_ignore(db_session, Identifier,
+        [dict(type='DOI', identifier=row.doi) for row in rows], returning=[Identifier.id])
+    doi_ids = ids_by(db_session, Identifier, ('identifier',), [row.doi for row in rows], Identifier.type == 'DOI')
+
+    # Editions: stub any that are missing, then update them all at once
+    edition_ids = ids_by(db_session, Edition, ('primary_identifier_id',), doi_ids.values())
+    stubs = [dict(data_source_id=data_source.id, primary_identifier_id=identifier_id)
+        for identifier_id in doi_ids.values() if identifier_id not in edition_ids]
+    for (edition_id, identifier_id) in insert_ignore(db_session, Edition, stubs,
+            returning=[Edition.id, Edition.primary_identifier_id]):
+        edition_ids[identifier_id] = edition_id
+    editions = Edition.__table__
+    update_editions = editions.update().where(editions.c.id == bindparam('b_id')).values(
+        title=func.coalesce(bindparam('b_title'), editions.c.title),
+        language=case([(bindparam('b_has_language'), bindparam('b_language'))], else_=editions.c.language),
+        publisher=bindparam('b_publisher'),
+        published=bindparam('b_published'),
+        description=func.coalesce(bindparam('b_description'), editions.c.description),
+        modified=func.coalesce(bindparam('b_modified'), editions.c.modified)
+    )
+    db_session.execute(update_editions, [dict(
+        b_id=edition_ids[doi_ids[row.doi]], b_title=row.title,
+        b_has_language=(row.language != None), b_language=(palace_language(row.language) if row.language else None),
+        b_publisher=row.publisher, b_published=row.published, b_description=row.description,
+        b_modified=(now if row.doi in changed else None)
+    ) for row in rows])
+
+    # Contributors and Contributions; names and ISBNs seen before come from the identity caches
+    (name_ids, names) = contributor_ids.lookup_many(name for row in rows for (name, role) in row.contributions)
+    found = ids_by(db_session, Contributor, ('name',), names)
+    for (contributor_id, name) in insert_ignore(db_session, Contributor,
+            [dict(name=name) for name in names if name not in found],
+            returning=[Contributor.id, Contributor.name]):
+        found[name] = contributor_id
+    contributor_ids.update(found)
+    name_ids.update(found)
+    insert_ignore(db_session, Contribution, [
+        dict(edition_id=edition_ids[doi_ids[row.doi]], contributor_id=name_ids[name], role=role)
+        for row in rows for (name, role) in row.contributions
+    ])
+
+    # ISBN Identifiers and Equivalencies
+    (cached, isbns) = identifier_ids.lookup_many(('ISBN', isbn) for row in rows for isbn in row.isbns)
+    isbn_ids = {isbn: identifier_id for ((type, isbn), identifier_id) in cached.items()}
+    isbns = [isbn for (type, isbn) in isbns]
+    insert_ignore(db_session, Identifier, [dict(type='ISBN', identifier=isbn) for isbn in isbns])
+    found = ids_by(db_session, Identifier, ('identifier',), isbns, Identifier.type == 'ISBN')
+    identifier_ids.update({('ISBN', isbn): identifier_id for (isbn, identifier_id) in found.items()})
+    isbn_ids.update(found)
+    existing = {tuple(equivalency) for equivalency in db_session.execute(
+        select([Equivalency.input_id, Equivalency.output_id]).
+            where(Equivalency.input_id.in_(list(doi_ids.values()))).
+            where(Equivalency.data_source_id == data_source.id)
+    )}
+    equivalencies = {(doi_ids[row.doi], isbn_ids[isbn]) for row in rows for isbn in row.isbns}
+    insert_ignore(db_session, Equivalency, [
+        dict(input_id=input_id, output_id=output_id, data_source_id=data_source.id)
+        for (input_id, output_id) in sorted(equivalencies - existing)
+    ])
+
+    # Resources
+    insert_ignore(db_session, Resource, [
+        dict(data_source_id=data_source.id, identifier_id=doi_ids[row.doi], url=url, media_type=media_type)
+        for row in rows for (url, media_type) in row.resources
+    ])
+
+    # Genres, from the precomputed genre table; genres a record no longer has are removed
+    genres = genre_ids_for(name for row in rows for name in row.genres)
+    set_identifier_genres({doi_ids[row.doi]: [genres[name] for name in row.genres] for row in rows})
+
+    upsert(db_session, RecordFingerprint, [
+        dict(identifier_id=doi_ids[row.doi], fingerprint=fingerprints[row.doi], updated=now)
+        for row in rows if row.doi in changed
+    ], ['identifier_id'], ['fingerprint', 'updated'])
+    return (len(new_identifiers), skipped)
+
+def load_edition(data_source, edition_data, force=False):
     find_with = dict(
         identifier=edition_data['doi'],
         type='DOI'
@@ -114,6 +303,12 @@ def load_edition(data_source, edition_data):
     (identifier, new) = get_one_or_create(
         db_session, Identifier, create_method_kwargs=create_with, **find_with
     )
+    # skip records whose content has not changed since they were last loaded
+    fingerprint = edition_fingerprint(normalize_edition(edition_data))
+    stored = None if new else db_session.query(RecordFingerprint).get(identifier.id)
+    changed = (stored == None) or (stored.fingerprint != fingerprint)
+    if (not changed) and (not force):
+        return (identifier, new, False)
     edition = None
     if (new):
         edition = stub_edition(data_source, identifier)[0]
@@ -121,10 +316,114 @@ def load_edition(data_source, edition_data):
         edition = edition_for_identifier(identifier)
         if (edition == None): edition = stub_edition(data_source, identifier)[0]
     update_edition(data_source, identifier, edition, edition_data)
+    if changed:
+        now = datetime.utcnow()
+        edition.modified = now
+        if stored == None:
+            create(db_session, RecordFingerprint, identifier_id=identifier.id, fingerprint=fingerprint, updated=now)
+        else:
+            stored.fingerprint = fingerprint
+            stored.updated = now
+
+    return (identifier, new, True)
 
-    return (identifier, new)
+def page_records(crawl_cache):
+    """Stream the records of one cached page, keeping the file open until they are consumed."""
+    with open(crawl_cache) as crawl_file:
+        yield from iter_page_records(crawl_file)
+
+def crawl_pages(crawl_log_path, store_dirs=None, batch_size=100):
+    """Yield an iterable of edition records for each cached page in the crawl
+    log, parsed incrementally, or batches of batch_size streamed from segment stores."""
+    if store_dirs:
+        for store_dir in store_dirs:
+            records = SegmentStore(store_dir).records()
+            batch = list(islice(records, batch_size))
+            while batch:
+                yield batch
+                batch = list(islice(records, batch_size))
+        return
+    with open(crawl_log_path) as crawl_log:
+        for crawl_cache in crawl_log:
+            yield page_records(crawl_cache.rstrip())
+
+def release_session(data_source):
+    # drop committed ORM objects so the identity map does not grow with the crawl
+    db_session.expunge_all()
+    db_session.add(data_source)
+
+def load_editions(data_source, pages, bulk=False, force=False):
+    num_identifiers = 0
+    num_skipped = 0
+    for records in pages:
+        if bulk:
+            (new, skipped) = bulk_load_editions(data_source, [normalize_edition(record) for record in records], force)
+            num_identifiers += new
+            num_skipped += skipped
+            db_session.commit()
+            release_session(data_source)
+            continue
+        for edition_data in records:
+            (identifier, new, loaded) = load_edition(data_source, edition_data, force)
+            if (new):
+                num_identifiers += 1
+            if (not loaded):
+                num_skipped += 1
+            db_session.flush()
+        db_session.commit()
+        release_session(data_source)
+    return (num_identifiers, num_skipped)
+
+def crawl_files(crawl_log_path, store_dirs=None):
+    """Paths of every cached page in the crawl log, or of every store segment."""
+    if store_dirs:
+        return [os.path.join(store_dir, name) for store_dir in store_dirs
+            for name in SegmentStore(store_dir).segment_names()]
+    with open(crawl_log_path) as crawl_log:
+        return [crawl_cache.rstrip() for crawl_cache in crawl_log]
+
+def normalize_crawl_file(crawl_cache):
+    # runs in a worker process: parse and map one page or segment without touching the database
+    if crawl_cache.endswith('.ndjson.gz'):
+        with gzip.open(crawl_cache, 'rb') as segment:
+            return [normalize_edition(json.loads(line)) for line in segment]
+    return [normalize_edition(edition_data) for edition_data in page_records(crawl_cache)]
+
+def parallel_load_editions(data_source, crawl_caches, workers, batch_size=100, force=False):
+    """Parse and normalize crawl files across worker processes while this
+    process, the only writer, bulk loads their rows in crawl order. A single
+    writer avoids unique-constraint races on identifiers and contributors,
+    which are shared across DOIs and so cannot be sharded by DOI."""
+    num_identifiers = 0
+    num_skipped = 0
+    with Pool(workers) as pool:
+        for rows in pool.imap(normalize_crawl_file, crawl_caches, chunksize=4):
+            for offset in range(0, len(rows), batch_size):
+                (new, skipped) = bulk_load_editions(data_source, rows[offset:offset + batch_size], force)
+                num_identifiers += new
+                num_skipped += skipped
+                db_session.commit()
+                release_session(data_source)
+    return (num_identifiers, num_skipped)
+
+def peak_memory_mib():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load cached Springer crawl records as editions.")
+    parser.add_argument("--store", action="append", dest="store_dirs", metavar="DIR",
+        help="read records from a crawl segment store instead of the crawl log; may be repeated")
+    parser.add_argument("--bulk", action="store_true",
+        help="write each crawl page with multi-row upserts instead of per-record lookups")
+    parser.add_argument("--workers", type=int, default=0,
+        help="parse and normalize crawl files in this many processes, bulk loading their rows from one writer")
+    parser.add_argument("--force", action="store_true",
+        help="reload records even when their fingerprint shows they are unchanged")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
     find_with = dict(
         name='SpringerNature',
         primary_identifier_type='DOI'
@@ -134,20 +433,20 @@ def main():
         db_session, DataSource, create_method_kwargs=create_with, **find_with
     )
     db_session.flush()
-    num_identifiers = 0
-    crawl_log_path = config['SPRINGER']['crawlLog']
-    with open(crawl_log_path) as crawl_log:
-        for crawl_cache in crawl_log:
-            with open(crawl_cache.rstrip()) as crawl_file:
-                crawl_json = json.loads(crawl_file.read())
-                if crawl_json == None: continue
-                for edition_data in crawl_json["records"]:
-                    (identifier, new) = load_edition(data_source, edition_data)
-                    if (new):
-                        num_identifiers += 1
-                    db_session.flush()
-                db_session.commit()
+    warm_caches(db_session, (contributor_ids, identifier_ids))
+    genre_table(db_session)
+    crawl_log_path = config['SPRINGER'].get('crawlLog')
+    if args.workers > 0:
+        crawl_caches = crawl_files(crawl_log_path, args.store_dirs)
+        (num_identifiers, num_skipped) = parallel_load_editions(data_source, crawl_caches, args.workers,
+            force=args.force)
+    else:
+        (num_identifiers, num_skipped) = load_editions(data_source, crawl_pages(crawl_log_path, args.store_dirs),
+            args.bulk, args.force)
     print("%s new identifiers" % (str(num_identifiers)))
+    print("%s unchanged records skipped" % (str(num_skipped)))
+    for stats in cache_stats((contributor_ids, identifier_ids)): print(stats)
+    print("peak resident memory %.1f MiB" % (peak_memory_mib()))
 
 if __name__ == "__main__":
     main()
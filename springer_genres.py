@@ -0,0 +1,44 @@
+import argparse
+from springer import config, db_session
+from springer.model import Identifier
+from springer.model.bulk import ids_by
+from springer_editions import crawl_pages, edition_genres, genre_ids_for, genre_table, set_identifier_genres
+
+# Reclassify loaded editions by genre from the crawl cache, one page at a time,
+# without reloading them.
+
+def classify_page(records):
+    """Make the genres of one page of records match the GENRES mapping with
+    one select, one delete and one insert. Records whose DOI has not been
+    loaded are left alone. Returns (genres added, genres removed, records not loaded)."""
+    genres_by_doi = {edition_data['doi']: edition_genres(edition_data) for edition_data in records}
+    doi_ids = ids_by(db_session, Identifier, ('identifier',), genres_by_doi.keys(), Identifier.type == 'DOI')
+    genres = genre_ids_for(name for names in genres_by_doi.values() for name in names)
+    (added, removed) = set_identifier_genres({doi_ids[doi]: [genres[name] for name in names]
+        for (doi, names) in genres_by_doi.items() if doi in doi_ids})
+    return (added, removed, len(genres_by_doi) - len(doi_ids))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Reclassify loaded Springer editions by genre from the crawl cache.")
+    parser.add_argument("--store", action="append", dest="store_dirs", metavar="DIR",
+        help="read records from a crawl segment store instead of the crawl log; may be repeated")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    genre_table(db_session)
+    db_session.commit()
+    num_added = 0
+    num_removed = 0
+    num_unloaded = 0
+    for records in crawl_pages(config['SPRINGER'].get('crawlLog'), args.store_dirs):
+        (added, removed, unloaded) = classify_page(records)
+        num_added += added
+        num_removed += removed
+        num_unloaded += unloaded
+        db_session.commit()
+    print("%s genres added, %s removed" % (str(num_added), str(num_removed)))
+    print("%s records not yet loaded as editions" % (str(num_unloaded)))
+
+if __name__ == "__main__":
+    main()
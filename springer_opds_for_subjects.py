@@ -1,13 +1,24 @@
+import argparse
 import json
+import multiprocessing
 import os
-from datetime import datetime
+from itertools import groupby
 from math import ceil
 from sqlalchemy import *
+from sqlalchemy import event
 from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
 from springer import blank_string, config, db_session
-from springer.model import SessionManager, Identifier, Edition, Subject, Classification, Contribution, DataSource, get_one_or_create
-from springer.subjects.csv_data import generate_subjects
+from springer.model import (
+    SessionManager, Identifier, Edition, Equivalency, Resource, Subject, Classification, Contribution, DataSource,
+    get_one_or_create
+)
+from springer.feeds.compress import ENCODINGS, PageCompressor, available, remove_page
+from springer.feeds.manifest import FeedManifest
+from springer.feeds.fragments import page_fingerprints, page_fragments, store_fragments
+from springer.feeds.writer import FeedWriter, serialize_publication, written_publications
+from springer.subjects.index import SubjectIndex
 from springer.mappings import opds_language
 def opds_images_for(identifier):
     # print or electronic ISBNs will work; sometimes DOI is a little weird and doesn't have the ISBN exactly
@@ -30,18 +41,23 @@ def opds_images_for(identifier):
             "type": "image/jpeg"
         }
     ]
-def opds_metadata_for(identifier, timestamp):
+def opds_metadata_for(identifier, subject_index=None):
     metadata = {}
     metadata['identifier'] = "https://dx.doi.org/%s" % (identifier.identifier)
-    metadata['modified'] = timestamp.isoformat()
     edition = identifier.editions[0]
+    # the loader stamps editions when their crawl record changes; older rows have no stamp and render
+    # none, as the run time would change every page on every run
+    if (edition.modified): metadata['modified'] = edition.modified.isoformat()
     metadata['title'] = edition.title
     metadata['language'] = opds_language(edition.language)
     if (not blank_string(edition.description)): metadata['description'] = edition.description
     metadata['@type'] = "http://schema.org/EBook" # TBD: Map from edition.medium pending migration
     if (edition.publisher): metadata['publisher'] = edition.publisher
     if (edition.published): metadata['published'] = str(edition.published)
-    subjects = [ classification.subject.name for classification in identifier.classifications]
+    if subject_index:
+        subjects = subject_index.subjects(identifier.identifier)
+    else:
+        subjects = [ classification.subject.name for classification in identifier.classifications]
     if (subjects != []): metadata['subjects'] = subjects
     authors = []
     editors = []
@@ -56,7 +72,7 @@ def opds_metadata_for(identifier, timestamp):
     if (len(editors) > 0): metadata['editor'] = editors
     return metadata
 
-def opds_publication(identifier, timestamp):
+def opds_publication(identifier, subject_index=None):
     resources = []
     for resource in identifier.resources:
         # TODO/CUL-Lyrasis: what vocabulary do we have to pattern these URLs? Could Springer API key be affilated with SAML IDP?
@@ -67,20 +83,30 @@ def opds_publication(identifier, timestamp):
         })
     images = opds_images_for(identifier)
     doc = {
-        'metadata': opds_metadata_for(identifier, timestamp)
+        'metadata': opds_metadata_for(identifier, subject_index)
     }
     if (len(images) > 0): doc['images'] = images
     if (len(resources) > 0): doc['links'] = resources
     return doc
 
-def opds_response_link(page_number, rel):
+FEED_BASE_URL = "https://ebooks-test.library.columbia.edu/static-feeds/springer/"
+MAIN_FEED = "springer_test_feed"
+NAVIGATION_FEED = "springer_subjects"
+
+def subject_feed(subject_id):
+    return "springer_subject_%s" % subject_id
+
+def feed_url(file_name):
+    return FEED_BASE_URL + file_name
+
+def opds_response_link(page_number, rel, feed=MAIN_FEED):
     return {
         "rel": rel,
-        "href": ("https://ebooks-test.library.columbia.edu/static-feeds/springer/springer_test_feed_%s.json" % page_number),
+        "href": feed_url("%s_%s.json" % (feed, page_number)),
         "type": "application/opds+json"
     }
 
-def opds_response_links(page_number, total_pages):
+def opds_response_links(page_number, total_pages, feed=MAIN_FEED):
     links = []
     self_rel = "self"
     first_rel = "first"
@@ -102,69 +128,589 @@ def opds_response_links(page_number, total_pages):
         next_rel = None
         last_rel = None
     if self_rel:
-        links.append(opds_response_link(page_number, self_rel))
+        links.append(opds_response_link(page_number, self_rel, feed))
     if first_rel:
-        links.append(opds_response_link(1, first_rel))
+        links.append(opds_response_link(1, first_rel, feed))
     if last_rel:
-        links.append(opds_response_link(total_pages, last_rel))
+        links.append(opds_response_link(total_pages, last_rel, feed))
     if next_rel:
-        links.append(opds_response_link(page_number + 1, next_rel))
+        links.append(opds_response_link(page_number + 1, next_rel, feed))
     if prev_rel:
-        links.append(opds_response_link(page_number - 1, prev_rel))
+        links.append(opds_response_link(page_number - 1, prev_rel, feed))
     return links
 
-def opds_response(page_number, count, page_size):
-    total_pages = ceil(count/page_size)
+def opds_response(page_number, count, page_size, feed=MAIN_FEED, title="Springer Test Feed", total_pages=None):
+    """The envelope of a feed page, whose itemsPerPage is page_size. Pages of
+    varying size pass total_pages, as it cannot be derived from count then."""
+    if total_pages == None:
+        total_pages = ceil(count/page_size)
     return {
         "metadata": {
-            "title": "Springer Test Feed",
+            "title": title,
             "itemsPerPage": page_size,
             "currentPage": page_number,
             "numberOfItems": count
         },
-        "links": opds_response_links(page_number, total_pages),
+        "links": opds_response_links(page_number, total_pages, feed),
         "publications": []
     }
-def cache_page(output_base_dir, opds_page, page_number):
-    out_file = os.path.join(output_base_dir, ("springer_test_feed_%s.json" % page_number))
-    with open(os.path.join(out_file), "w") as f:
-        json.dump(opds_page, f, indent=2)
+def feed_path(output_base_dir, page_number, feed=MAIN_FEED):
+    return os.path.join(output_base_dir, ("%s_%s.json" % (feed, page_number)))
 
-def main():
-    output_base_dir = "output_test/springer/opds"
-    os.makedirs(output_base_dir, exist_ok=True)
+def cache_page(output_base_dir, opds_page, page_number, publications=(), pretty=False, previous_digest=None,
+        feed=MAIN_FEED):
+    """Write opds_page with (key, publication) pairs rendered as they are written;
+    a publication may also be a fragment already serialized for this writer.
+    A page whose content hashes to previous_digest is left untouched. Returns the closed FeedWriter."""
+    with FeedWriter(feed_path(output_base_dir, page_number, feed), pretty, previous_digest) as writer:
+        writer.begin(opds_page)
+        for (key, publication) in publications:
+            if isinstance(publication, str):
+                writer.serialized(publication, key)
+            else:
+                writer.publication(publication, key)
+    return writer
 
-    q = db_session.query(Identifier).join(Classification, Classification.identifier_id == Identifier.id, isouter=True)
-    count = q.filter(Identifier.type == 'DOI').filter(Classification.id == None).count()
-    total = db_session.query(Identifier).\
-        filter(Identifier.type == 'DOI').\
-        filter(Identifier.editions.any()).\
-        count()
-    print("%s identifiers of %s have no subjects" % (str(count), str(total)))
-    q = db_session.query(Identifier).\
+# rows fetched at a time from each of a page's streamed queries
+STREAM_ROWS = 200
+# publications rendered between writes of their fragments to the cache
+FRAGMENT_BATCH = 100
+
+class RelatedRows(object):
+    """One relationship's rows for a page, streamed in identifier id order and
+    handed out an identifier at a time as the page is walked in the same order."""
+
+    def __init__(self, q, identifier_id_of):
+        self.groups = groupby(q.yield_per(STREAM_ROWS), identifier_id_of)
+        self.group = next(self.groups, None)
+
+    def take(self, identifier_id):
+        while self.group != None and self.group[0] < identifier_id:
+            self.group = next(self.groups, None)
+        if self.group == None or self.group[0] != identifier_id: return []
+        rows = list(self.group[1])
+        self.group = next(self.groups, None)
+        return rows
+
+def page_identifiers(start_id, end_id, subject_index=None, identifier_ids=None):
+    """The export's identifiers from start_id up to end_id, or only those among
+    identifier_ids, in id order with everything opds_publication reads set on them.
+    Each collection is one query over the whole range, streamed alongside the
+    identifiers and matched to them by id, so a page costs the same number of
+    queries whatever its size and only the identifier being rendered is held."""
+    def within(q, identifier_id):
+        q = q.filter(identifier_id >= start_id)
+        if end_id != None:
+            q = q.filter(identifier_id < end_id)
+        if identifier_ids != None:
+            q = q.filter(identifier_id.in_(identifier_ids))
+        return q
+    identifiers = within(export_query(), Identifier.id).order_by(Identifier.id).yield_per(STREAM_ROWS)
+    editions = RelatedRows(within(db_session.query(Edition), Edition.primary_identifier_id).
+        order_by(Edition.primary_identifier_id, Edition.id), lambda edition: edition.primary_identifier_id)
+    contributions = RelatedRows(within(db_session.query(Edition.primary_identifier_id, Contribution).
+        join(Contribution, Contribution.edition_id == Edition.id).options(joinedload(Contribution.contributor)),
+        Edition.primary_identifier_id).order_by(Edition.primary_identifier_id, Contribution.id),
+        lambda row: row[0])
+    equivalents = RelatedRows(within(db_session.query(Equivalency.input_id, Identifier).
+        join(Identifier, Identifier.id == Equivalency.output_id), Equivalency.input_id).
+        order_by(Equivalency.input_id, Identifier.identifier), lambda row: row[0])
+    resources = RelatedRows(within(db_session.query(Resource), Resource.identifier_id).
+        order_by(Resource.identifier_id, Resource.id), lambda resource: resource.identifier_id)
+    # with a subject index built from the CSV, subjects are read from it instead
+    classifications = None
+    if subject_index == None:
+        classifications = RelatedRows(within(db_session.query(Classification).
+            options(joinedload(Classification.subject)), Classification.identifier_id).
+            order_by(Classification.identifier_id, Classification.id), lambda row: row.identifier_id)
+    for identifier in identifiers:
+        identifier_editions = editions.take(identifier.id)
+        identifier_contributions = [contribution for (identifier_id, contribution) in contributions.take(identifier.id)]
+        for edition in identifier_editions:
+            set_committed_value(edition, 'contributions',
+                [contribution for contribution in identifier_contributions if contribution.edition_id == edition.id])
+        set_committed_value(identifier, 'editions', identifier_editions)
+        set_committed_value(identifier, 'equivalent_identifiers',
+            [equivalent for (input_id, equivalent) in equivalents.take(identifier.id)])
+        set_committed_value(identifier, 'resources', resources.take(identifier.id))
+        if classifications:
+            set_committed_value(identifier, 'classifications', classifications.take(identifier.id))
+        yield identifier
+
+def count_queries(engine):
+    """Count statements sent through engine, in the returned dict's 'queries'."""
+    counter = dict(queries=0)
+    def before_cursor_execute(*args):
+        counter['queries'] += 1
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    return counter
+
+def page_boundaries(q, page_size):
+    """First Identifier.id of each page of q ordered by id, from one pass over ids only."""
+    numbered = q.with_entities(
+        Identifier.id.label('id'), func.row_number().over(order_by=Identifier.id).label('row_number')
+    ).subquery()
+    starts = db_session.query(numbered.c.id).\
+        filter((numbered.c.row_number - 1) % page_size == 0).\
+        order_by(numbered.c.id)
+    return [start for (start,) in starts]
+
+def publication_sizes(exporter, q, chunk_size):
+    """(identifier id, serialized bytes) for every identifier of q in id order.
+    Sizes come from the exporter's own output, so with fragments only the
+    publications missing from the cache are rendered, and cached for the export."""
+    for (page_number, start_id, end_id) in page_ranges(page_boundaries(q, chunk_size)):
+        for (identifier_id, doi, text) in exporter.page_publications(start_id, end_id):
+            yield (identifier_id, len(text.encode('utf-8')))
+        db_session.commit()
+        db_session.expunge_all()
+
+def budgeted_boundaries(sizes, page_bytes, max_items, separator_bytes=1):
+    """First Identifier.id and number of items of each page, packing publications
+    in id order until the next would take the page past page_bytes or the page
+    holds max_items. A publication larger than page_bytes gets a page of its own."""
+    (starts, items) = ([], [])
+    used = 0
+    for (identifier_id, size) in sizes:
+        if (not items) or items[-1] == max_items or used + separator_bytes + size > page_bytes:
+            starts.append(identifier_id)
+            items.append(0)
+            used = 0
+        items[-1] += 1
+        used += separator_bytes + size
+    return (starts, items)
+
+def page_ranges(boundaries):
+    """(page number, first id, first id of the next page or None) for every page."""
+    return [(page_number, start, boundaries[page_number] if page_number < len(boundaries) else None)
+        for (page_number, start) in enumerate(boundaries, 1)]
+
+def page_query(q, start_id, end_id):
+    # seek to the page's id range, so no earlier rows are read or skipped
+    q = q.filter(Identifier.id >= start_id)
+    if end_id != None:
+        q = q.filter(Identifier.id < end_id)
+    return q.order_by(Identifier.id)
+
+def export_query():
+    """DOIs with an edition, subjects and resources: the identifiers the feed publishes."""
+    return db_session.query(Identifier).\
         filter(Identifier.type == 'DOI').\
         filter(Identifier.editions.any()).\
         filter(Identifier.classifications.any()).\
         filter(Identifier.resources.any())
-    count = q.count()
-    print("%s editions of %s have subjects and resources" % (str(count), str(total)))
-    load_query = q.options(
-        joinedload(Identifier.editions), joinedload(Identifier.classifications).joinedload(Classification.subject)
-    )
-    timestamp = datetime.utcnow()
-    page_size = 1000
-    total_pages = ceil(count/page_size)
-    print("%s editions yield %s pages" % (str(count), str(total_pages)))
-    load_query = load_query.limit(page_size)
-    offset = 0
-    while offset < count:
-        page_number = int((offset / page_size) + 1)
-        identifiers_page = load_query.offset(offset).all()
-        response = opds_response(page_number, count, page_size)
-        for identifier in identifiers_page:
-            response['publications'].append(opds_publication(identifier, timestamp))
-        cache_page(output_base_dir, response, page_number)
-        offset += page_size
-        print("cached page %s of %s" % (str(page_number), str(total_pages)))
+
+class PageExporter(object):
+    """Renders and writes feed pages given their id ranges. Holds only plain
+    settings, so it can be sent to worker processes, each of which then
+    queries through its own db_session."""
+
+    def __init__(self, output_base_dir, count, page_size, pretty=False, subject_index_path=None,
+            digests=None, use_fragments=True):
+        self.output_base_dir = output_base_dir
+        # page number -> SHA-256 of the page as last written, from the feed manifest
+        self.digests = digests or {}
+        self.count = count
+        self.page_size = page_size
+        self.pretty = pretty
+        self.subject_index_path = subject_index_path
+        # fragments are cached compact, so pretty debugging output is always rendered
+        self.use_fragments = use_fragments and not pretty
+        self.subject_index = None
+        self.counter = None
+        # publications rendered through the ORM for the page being exported
+        self.rendered = 0
+        self.total_pages = ceil(count/page_size)
+        # page number -> items on the page, when pages are not all page_size long
+        self.page_items = None
+        # set in the parent process only, to route publications into subject feeds
+        self.router = None
+
+    def __getstate__(self):
+        # the index and counter belong to this process; a worker makes its own
+        state = dict(self.__dict__)
+        state.update(subject_index=None, counter=None, router=None)
+        return state
+
+    def paginate(self, total_pages, page_items=None):
+        self.total_pages = total_pages
+        self.page_items = page_items
+
+    def prepare(self):
+        """Open the subject index and start counting queries, once in each process."""
+        if self.counter == None:
+            self.subject_index = SubjectIndex(self.subject_index_path) if self.subject_index_path else None
+            self.counter = count_queries(db_session.get_bind().engine)
+
+    def export(self, page):
+        """Write one (page number, first id, end id) page; returns a dict describing it for the feed manifest."""
+        (page_number, start_id, end_id) = page
+        self.prepare()
+        self.counter['queries'] = 0
+        self.rendered = 0
+        items = self.page_items[page_number] if self.page_items else self.page_size
+        response = opds_response(page_number, self.count, items, total_pages=self.total_pages)
+        publications = self.page_publications(start_id, end_id)
+        if self.router:
+            publications = self.router.routed(publications, start_id, end_id)
+        writer = cache_page(self.output_base_dir, response, page_number,
+            ((doi, text) for (identifier_id, doi, text) in publications), self.pretty,
+            self.digests.get(str(page_number)))
+        # keep the fragments cached for the page and release its ORM objects before the next one
+        db_session.commit()
+        db_session.expunge_all()
+        return dict(page_number=page_number, path=writer.path, queries=self.counter['queries'], rendered=self.rendered,
+            changed=writer.changed, digest=writer.digest, size=writer.size, publications=writer.publication_digests)
+
+    def page_publications(self, start_id, end_id):
+        """Yield (identifier id, DOI, publication serialized for this exporter's pages)
+        for each identifier of a page in id order, counting those rendered through the ORM."""
+        self.prepare()
+        if self.use_fragments:
+            return self.fragments(start_id, end_id)
+        return self.render(page_identifiers(start_id, end_id, self.subject_index))
+
+    def render(self, identifiers):
+        for identifier in identifiers:
+            self.rendered += 1
+            yield (identifier.id, identifier.identifier, serialize_publication(
+                opds_publication(identifier, self.subject_index), self.pretty))
+
+    def fragments(self, start_id, end_id):
+        """Like page_publications, rendering through the ORM only the identifiers
+        whose cached fragment is missing or stale. Cached fragments are streamed
+        and rendered ones cached FRAGMENT_BATCH at a time, so only the stale
+        identifiers' fingerprints are held for the page. The caller commits."""
+        q = page_query(export_query(), start_id, end_id).yield_per(STREAM_ROWS)
+        stale = {identifier_id: fingerprint for (identifier_id, fingerprint, cached) in
+            page_fingerprints(q, self.subject_index) if fingerprint != cached}
+        rendered = None
+        if stale:
+            rendered = self.render(page_identifiers(start_id, end_id, self.subject_index, sorted(stale)))
+        batch = {}
+        for (identifier_id, doi, fragment) in page_fragments(q):
+            if identifier_id in stale:
+                (identifier_id, doi, fragment) = next(rendered)
+                batch[identifier_id] = (stale[identifier_id], fragment)
+                if len(batch) == FRAGMENT_BATCH:
+                    store_fragments(db_session, batch)
+                    batch = {}
+            yield (identifier_id, doi, fragment)
+        store_fragments(db_session, batch)
+
+def subject_counts(q):
+    """subject id -> (name, number of q's identifiers it classifies), from one GROUP BY."""
+    ids = q.with_entities(Identifier.id).subquery()
+    rows = db_session.query(Subject.id, Subject.name, func.count(distinct(Classification.identifier_id))).\
+        join(Classification, Classification.subject_id == Subject.id).\
+        filter(Classification.identifier_id.in_(select([ids.c.id]))).\
+        group_by(Subject.id, Subject.name)
+    return {subject_id: (name, count) for (subject_id, name, count) in rows}
+
+class SubjectFeedRouter(object):
+    """Builds a paginated feed per subject while the main feed is exported.
+
+    Publications are routed, already serialized, into a buffer per subject;
+    a subject's page is written as soon as it is full. When the buffers hold
+    more than buffer_bytes in all, the largest are appended to spill files
+    beside the feeds and read back when their page is written. Subject pages
+    hold publications in id order, like the main feed, so the page counts
+    and links fixed from subject_counts are right.
+    """
+
+    RECORD_SEPARATOR = '\x1e'
+    UNIT_SEPARATOR = '\x1f'
+
+    def __init__(self, output_base_dir, subjects, page_size, pretty=False, manifest=None, buffer_bytes=64 * 1024 * 1024,
+            compressor=None):
+        self.output_base_dir = output_base_dir
+        self.compressor = compressor
+        self.subjects = subjects
+        self.page_size = page_size
+        self.pretty = pretty
+        self.manifest = manifest
+        self.buffer_bytes = buffer_bytes
+        self.page_numbers = {subject_id: 1 for subject_id in subjects}
+        self.buffers = {}
+        self.buffered_bytes = {}
+        self.items = {}
+        self.total_bytes = 0
+        self.written = []
+        self.counts = dict(changed=0, unchanged=0, spills=0)
+        self._page_subjects = {}
+        # spill files left by an interrupted run would be appended to
+        for subject_id in subjects:
+            if os.path.exists(self.spill_path(subject_id)): os.remove(self.spill_path(subject_id))
+
+    def routed(self, publications, start_id, end_id):
+        """Pass (identifier id, DOI, text) through, routing each into its subjects' feeds."""
+        self.load_page(start_id, end_id)
+        for (identifier_id, doi, text) in publications:
+            self.add(doi, text)
+            yield (identifier_id, doi, text)
+
+    def route_written(self, path, dois, start_id, end_id):
+        """Route a page another process wrote to path, reading it back a
+        publication at a time; dois are its publications' DOIs in page order."""
+        self.load_page(start_id, end_id)
+        for (doi, text) in zip(dois, written_publications(path)):
+            self.add(doi, text)
+
+    def load_page(self, start_id, end_id):
+        # the subjects of every DOI in the page's id range, in one query
+        q = select([Identifier.identifier, Classification.subject_id]).distinct().\
+            select_from(Classification.__table__.join(Identifier.__table__)).\
+            where(Classification.identifier_id >= start_id).\
+            order_by(Identifier.identifier, Classification.subject_id)
+        if end_id != None:
+            q = q.where(Classification.identifier_id < end_id)
+        self._page_subjects = {}
+        for (doi, subject_id) in db_session.execute(q):
+            self._page_subjects.setdefault(doi, []).append(subject_id)
+
+    def add(self, doi, text):
+        for subject_id in self._page_subjects.get(doi, []):
+            if subject_id not in self.subjects: continue
+            self.buffers.setdefault(subject_id, []).append((doi, text))
+            self.buffered_bytes[subject_id] = self.buffered_bytes.get(subject_id, 0) + len(text)
+            self.total_bytes += len(text)
+            self.items[subject_id] = self.items.get(subject_id, 0) + 1
+            if self.items[subject_id] == self.page_size:
+                self.write_page(subject_id)
+        if self.total_bytes > self.buffer_bytes:
+            self.spill()
+
+    def spill_path(self, subject_id):
+        return os.path.join(self.output_base_dir, subject_feed(subject_id) + '.spill')
+
+    def spill(self):
+        # append the largest buffers to their spill files until half the budget is free
+        self.counts['spills'] += 1
+        for subject_id in sorted(self.buffers, key=lambda subject_id: -self.buffered_bytes[subject_id]):
+            if self.total_bytes <= self.buffer_bytes // 2: break
+            with open(self.spill_path(subject_id), 'a') as spill:
+                for (doi, text) in self.buffers.pop(subject_id):
+                    spill.write(doi + self.UNIT_SEPARATOR + text + self.RECORD_SEPARATOR)
+            self.total_bytes -= self.buffered_bytes.pop(subject_id)
+
+    def spilled(self, subject_id):
+        path = self.spill_path(subject_id)
+        if not os.path.exists(path): return
+        with open(path) as spill:
+            for record in spill.read().split(self.RECORD_SEPARATOR)[:-1]:
+                yield tuple(record.split(self.UNIT_SEPARATOR, 1))
+        os.remove(path)
+
+    def write_page(self, subject_id):
+        (name, count) = self.subjects[subject_id]
+        page_number = self.page_numbers[subject_id]
+        feed = subject_feed(subject_id)
+        key = "%s_%s" % (feed, page_number)
+        buffered = self.buffers.pop(subject_id, [])
+        self.total_bytes -= self.buffered_bytes.pop(subject_id, 0)
+        publications = [item for item in self.spilled(subject_id)] + buffered
+        response = opds_response(page_number, count, self.page_size, feed, "Springer: %s" % name)
+        writer = cache_page(self.output_base_dir, response, page_number, publications, self.pretty,
+            self.manifest.digest(key) if self.manifest else None, feed)
+        if self.manifest: self.manifest.record(key, writer.digest, writer.size, writer.publication_digests)
+        if self.compressor: self.compressor.page_written(writer.path, writer.changed)
+        self.counts['changed' if writer.changed else 'unchanged'] += 1
+        self.written.append(key)
+        self.page_numbers[subject_id] = page_number + 1
+        self.items[subject_id] = 0
+
+    def finish(self):
+        """Write every subject's last, partly filled page and the navigation feed;
+        remove pages of earlier runs that no longer exist."""
+        for subject_id in sorted(subject_id for (subject_id, items) in self.items.items() if items):
+            self.write_page(subject_id)
+        self.write_navigation()
+        if self.manifest:
+            for key in self.manifest.retain(self.written):
+                remove_page(os.path.join(self.output_base_dir, key + '.json'))
+
+    def write_navigation(self):
+        navigation = [{
+            "href": feed_url("%s_1.json" % subject_feed(subject_id)),
+            "title": name,
+            "type": "application/opds+json",
+            "properties": {"numberOfItems": count}
+        } for (subject_id, (name, count)) in sorted(self.subjects.items(), key=lambda item: (item[1][0], item[0]))]
+        doc = {
+            "metadata": {"title": "Springer Subjects"},
+            "links": [{"rel": "self", "href": feed_url("%s.json" % NAVIGATION_FEED), "type": "application/opds+json"}],
+            "navigation": navigation
+        }
+        path = os.path.join(self.output_base_dir, "%s.json" % NAVIGATION_FEED)
+        text = json.dumps(doc, indent=2) if self.pretty else json.dumps(doc, separators=(',', ':'))
+        previous = None
+        if os.path.exists(path):
+            with open(path) as f:
+                previous = f.read()
+        # like the pages, left untouched when unchanged
+        if text != previous:
+            with open(path + '.tmp', 'w') as f:
+                f.write(text)
+            os.replace(path + '.tmp', path)
+        if self.compressor: self.compressor.page_written(path, text != previous)
+
+# the exporter of a worker process, set by init_worker
+worker_exporter = None
+
+def init_worker(exporter):
+    global worker_exporter
+    worker_exporter = exporter
+
+def export_in_worker(page):
+    return worker_exporter.export(page)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export Springer editions with subjects as paginated OPDS 2 feeds.")
+    parser.add_argument("--page", type=int, help="regenerate only this page")
+    parser.add_argument("--pretty", action="store_true", help="indent the feed JSON, for debugging")
+    parser.add_argument("--page-size", type=int, default=1000,
+        help="publications per page; with --page-kb, the most a page may hold")
+    parser.add_argument("--page-kb", type=int, default=None,
+        help="pack each page with publications up to this many KiB of JSON instead of a fixed number")
+    parser.add_argument("--manifest", default="feed_manifest.json",
+        help="page and publication hashes, relative to the output directory; unchanged pages are not rewritten")
+    parser.add_argument("--no-fragments", action="store_true",
+        help="render every publication instead of reusing cached fragments of unchanged ones")
+    parser.add_argument("--subject-feeds", action="store_true",
+        help="also write a paginated feed per subject and a navigation feed listing them")
+    parser.add_argument("--subject-buffer-mb", type=int, default=64,
+        help="memory for subject feed pages in progress before they spill to disk")
+    parser.add_argument("--workers", type=int, default=0,
+        help="render and write pages in this many processes, each with its own database session")
+    parser.add_argument("--compress", default="",
+        help="comma-separated encodings (gz, br) to write beside each changed page, for the web server to send as they are")
+    parser.add_argument("--compress-threads", type=int, default=None,
+        help="threads compressing pages while the export goes on; by default, the thread pool size Python picks")
+    args = parser.parse_args()
+    args.compress = [encoding for encoding in args.compress.split(',') if encoding]
+    for encoding in args.compress:
+        if encoding not in ENCODINGS:
+            parser.error("unknown encoding %s; choose from %s" % (encoding, ', '.join(ENCODINGS)))
+        if not available(encoding):
+            parser.error("cannot write .%s pages: brotli is not installed" % (encoding))
+    return args
+
+def main():
+    args = parse_args()
+    output_base_dir = "output_test/springer/opds"
+    os.makedirs(output_base_dir, exist_ok=True)
+
+    page_size = args.page_size
+    manifest = FeedManifest(os.path.join(output_base_dir, args.manifest))
+    q = export_query()
+    # a single page is regenerated to fit the feed as last written in full, so
+    # the catalogue is neither counted nor paged again
+    settings = dict(page_size=page_size, page_kb=args.page_kb, pretty=args.pretty)
+    paging = manifest.paging if (args.page and manifest.paging and manifest.paging['settings'] == settings) else None
+    if paging:
+        count = paging['count']
+        print("%s editions in %s pages when the feed was last written" % (str(count), str(len(paging['boundaries']))))
+    else:
+        no_subjects = db_session.query(Identifier).\
+            join(Classification, Classification.identifier_id == Identifier.id, isouter=True).\
+            filter(Identifier.type == 'DOI').filter(Classification.id == None).count()
+        total = db_session.query(Identifier).\
+            filter(Identifier.type == 'DOI').\
+            filter(Identifier.editions.any()).\
+            count()
+        print("%s identifiers of %s have no subjects" % (str(no_subjects), str(total)))
+        count = q.count()
+        print("%s editions of %s have subjects and resources" % (str(count), str(total)))
+    subject_index_path = None
+    if config.has_option('CSV', 'subjectsIndex'):
+        subject_index_path = config['CSV']['subjectsIndex']
+    exporter = PageExporter(output_base_dir, count, page_size, args.pretty, subject_index_path,
+        manifest.digests(), not args.no_fragments)
+    # page ranges, counts and so the links between pages are fixed here, before any worker starts
+    items = None
+    if paging:
+        (boundaries, items) = (paging['boundaries'], paging['items'])
+    elif args.page_kb:
+        # the largest envelope: a middle page with all five links, page numbers longer than any real one;
+        # pretty publications are joined by ',\n    '
+        envelope = opds_response(99999, count, page_size, total_pages=199999)
+        envelope_bytes = len(json.dumps(envelope, indent=2) if args.pretty else json.dumps(envelope, separators=(',', ':')))
+        (boundaries, items) = budgeted_boundaries(publication_sizes(exporter, q, page_size),
+            args.page_kb * 1024 - envelope_bytes, page_size, 6 if args.pretty else 1)
+        print("%s editions yield %s pages of at most %s KiB or %s publications, holding %s to %s" % (str(count),
+            str(len(boundaries)), str(args.page_kb), str(page_size), str(min(items or [0])), str(max(items or [0]))))
+    else:
+        boundaries = page_boundaries(q, page_size)
+        print("%s editions yield %s pages" % (str(count), str(len(boundaries))))
+    if items:
+        exporter.paginate(len(boundaries), dict(enumerate(items, 1)))
+    if not args.page:
+        manifest.paging = dict(settings=settings, count=count, boundaries=boundaries, items=items)
+    pages = page_ranges(boundaries)
+    total_pages = len(pages)
+    if args.page:
+        if not (1 <= args.page <= total_pages):
+            raise ValueError("page %s is not between 1 and %s" % (str(args.page), str(total_pages)))
+        pages = [pages[args.page - 1]]
+    counts = dict(changed=0, unchanged=0, publications=0)
+    compressor = PageCompressor(args.compress, args.compress_threads)
+    router = None
+    if args.subject_feeds and args.page:
+        print("subject feeds need a full export; not written for a single page")
+    elif args.subject_feeds:
+        subjects = subject_counts(q)
+        print("%s subjects get feeds" % (str(len(subjects))))
+        subject_manifest = FeedManifest(os.path.join(output_base_dir, "subject_" + args.manifest))
+        router = SubjectFeedRouter(output_base_dir, subjects, page_size, args.pretty, subject_manifest,
+            args.subject_buffer_mb * 1024 * 1024, compressor)
+    try:
+        if args.workers > 0:
+            # spawned, not forked, so no worker shares this process's database connection
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(args.workers, initializer=init_worker, initargs=(exporter,)) as pool:
+                if router:
+                    # workers cannot share the router: each page is routed here in page order,
+                    # read back from its file with the DOIs the worker recorded for it
+                    for ((page_number, start_id, end_id), exported) in zip(pages, pool.imap(export_in_worker, pages)):
+                        record_page(manifest, exported, total_pages, counts, compressor)
+                        router.route_written(exported['path'], exported['publications'], start_id, end_id)
+                else:
+                    for exported in pool.imap_unordered(export_in_worker, pages):
+                        record_page(manifest, exported, total_pages, counts, compressor)
+        else:
+            exporter.router = router
+            for page in pages:
+                record_page(manifest, exporter.export(page), total_pages, counts, compressor)
+        if router:
+            router.finish()
+            router.manifest.save()
+            print("%s subject pages rewritten, %s unchanged, %s spills to disk" % (str(router.counts['changed']),
+                str(router.counts['unchanged']), str(router.counts['spills'])))
+        if not args.page:
+            for page_number in manifest.prune(total_pages):
+                remove_page(feed_path(output_base_dir, page_number))
+                print("removed page %s" % (str(page_number)))
+    finally:
+        compressor.close()
+        manifest.save()
+    print("%s pages rewritten, %s unchanged; %s publications new or changed" % (str(counts['changed']),
+        str(counts['unchanged']), str(counts['publications'])))
+    if args.compress:
+        ratios = compressor.ratios()
+        print("%s pages compressed: %s" % (str(compressor.pages), ', '.join("%s to %.1f%% of %s bytes" % (
+            encoding, 100 * ratios[encoding], str(compressor.page_bytes[encoding])) for encoding in args.compress)))
+
+def record_page(manifest, exported, total_pages, counts, compressor):
+    page_number = exported['page_number']
+    compressor.page_written(exported['path'], exported['changed'])
+    counts['publications'] += manifest.record(page_number, exported['digest'], exported['size'],
+        exported['publications'])
+    if exported['changed']:
+        counts['changed'] += 1
+        print("cached page %s of %s in %s queries, %s publications rendered" % (str(page_number), str(total_pages),
+            str(exported['queries']), str(exported['rendered'])))
+    else:
+        counts['unchanged'] += 1
+        print("page %s of %s unchanged" % (str(page_number), str(total_pages)))
 if __name__ == "__main__":
     main()
@@ -1,26 +1,23 @@
+import argparse
 import csv
 import os
+from itertools import groupby
 from sqlalchemy import *
 from sqlalchemy.engine.url import make_url
 from springer import blank_string, config, db_session
 from springer.model import SessionManager, Identifier, Subject, Classification, DataSource, get_one_or_create
-from springer.subjects.csv_data import generate_subjects
+from springer.model.bulk import ids_by, insert_ignore, upsert
+from springer.model.cache import cache_stats, identifier_ids, subject_ids, warm_caches
+from springer.subjects.rows import generate_subjects
 
-def main():
-    find_with = dict(
-        name='SpringerNature',
-        primary_identifier_type='DOI'
-    )
+def load_subjects(data_source, csv_path):
     create_with = dict()
-    data_source, new = get_one_or_create(
-        db_session, DataSource, create_method_kwargs=create_with, **find_with
-    )
     num_identifiers = 0
     num_subjects = 0
-    csv_path = config['CSV']['springerSubjects']
     with open(csv_path, newline='') as csvfile:
         csv_reader = csv.reader(csvfile, delimiter=',', quotechar='"')
-        identifier = None
+        doi = None
+        identifier_id = None
         new = False
         for csv_subject in generate_subjects(csv_reader):
             if (blank_string(csv_subject['doi'])): continue
@@ -28,24 +25,21 @@ def main():
                 identifier=csv_subject['doi'],
                 type='DOI'
             )
-            if (identifier == None) or (identifier.identifier != csv_subject['doi']):
-                if (identifier != None): db_session.commit()
-                (identifier, new) = get_one_or_create(
-                    db_session, Identifier, create_method_kwargs=create_with, **find_with
-                )
+            if (doi == None) or (doi != csv_subject['doi']):
+                if (doi != None): db_session.commit()
+                doi = csv_subject['doi']
+                (identifier_id, new) = identifier_ids.id_for(db_session, **find_with)
                 if (new):
                     num_identifiers += 1
             find_with = dict(
                 name=csv_subject['name'],
             )
-            (subject, new) = get_one_or_create(
-                db_session, Subject, create_method_kwargs=create_with, **find_with
-            )
+            (subject_id, new) = subject_ids.id_for(db_session, **find_with)
             if (new): num_subjects += 1
 
             find_with = dict(
-                identifier_id=identifier.id,
-                subject_id=subject.id,
+                identifier_id=identifier_id,
+                subject_id=subject_id,
                 data_source_id=data_source.id
             )
             classification, new = get_one_or_create(
@@ -56,7 +50,201 @@ def main():
             else:
                 classification.weight = 50
         db_session.commit()
+    return (num_subjects, num_identifiers)
+
+def csv_classifications(csv_path):
+    """Stream (doi, subject name, weight) for every subject cell in the CSV."""
+    with open(csv_path, newline='') as csvfile:
+        csv_reader = csv.reader(csvfile, delimiter=',', quotechar='"')
+        for csv_subject in generate_subjects(csv_reader):
+            if (blank_string(csv_subject['doi'])): continue
+            yield (csv_subject['doi'], csv_subject['name'], 100 if csv_subject['primary'] else 50)
+
+def bulk_load_subjects(data_source, csv_path, batch_rows=10000):
+    """Load the CSV in two passes: create every missing subject in one insert,
+    then upsert classifications batch_rows at a time, committing after each
+    batch. Produces the same rows as load_subjects."""
+    names = {name for (doi, name, weight) in csv_classifications(csv_path)}
+    found = ids_by(db_session, Subject, ('name',), names)
+    # subjects have no type, so the (type, name) constraint cannot catch duplicates: insert only unseen names
+    new_subjects = insert_ignore(db_session, Subject, [dict(name=name) for name in sorted(names) if name not in found],
+        returning=[Subject.id, Subject.name])
+    found.update({name: subject_id for (subject_id, name) in new_subjects})
+    subject_ids.update(found)
+    db_session.commit()
+
+    num_identifiers = 0
+    batch = {}
+    for (doi, name, weight) in csv_classifications(csv_path):
+        # a later cell for the same DOI and subject overrides an earlier one, as in load_subjects
+        batch[(doi, name)] = weight
+        if len(batch) >= batch_rows:
+            num_identifiers += upsert_classifications(data_source, batch, found)
+            batch = {}
+    num_identifiers += upsert_classifications(data_source, batch, found)
+    return (len(new_subjects), num_identifiers)
+
+def upsert_classifications(data_source, weights, subject_ids_by_name):
+    """Write one batch of {(doi, subject name): weight}; returns the number of new DOI identifiers."""
+    if not weights: return 0
+    dois = sorted({doi for (doi, name) in weights})
+    new_identifiers = insert_ignore(db_session, Identifier,
+        [dict(type='DOI', identifier=doi) for doi in dois], returning=[Identifier.id])
+    doi_ids = ids_by(db_session, Identifier, ('identifier',), dois, Identifier.type == 'DOI')
+    rows = {}
+    for ((doi, name), weight) in weights.items():
+        key = (doi_ids[doi], subject_ids_by_name[name])
+        rows[key] = dict(identifier_id=key[0], subject_id=key[1], data_source_id=data_source.id, weight=weight)
+    upsert(db_session, Classification, list(rows.values()),
+        ['identifier_id', 'subject_id', 'data_source_id'], ['weight'])
+    db_session.commit()
+    return len(new_identifiers)
+
+def csv_subjects_by_doi(csv_path):
+    """Yield (doi, {subject name: weight}) in DOI order; the CSV must be sorted by DOI."""
+    previous = None
+    for (doi, cells) in groupby(csv_classifications(csv_path), key=lambda cell: cell[0]):
+        if previous != None and doi <= previous:
+            raise ValueError("%s is not sorted by DOI: %s follows %s" % (csv_path, doi, previous))
+        previous = doi
+        # a later cell for the same subject overrides an earlier one, as in load_subjects
+        yield (doi, {name: weight for (doi, name, weight) in cells})
+
+def check_sorted_by_doi(csv_path):
+    """Raise ValueError unless the whole CSV is sorted by DOI. The merge
+    commits batch by batch, so this is checked before anything is written:
+    found halfway, a misordered DOI would already have had its stored
+    classifications deleted as missing from the export."""
+    for (doi, subjects) in csv_subjects_by_doi(csv_path): pass
+
+def stored_subjects_by_doi(connection, data_source):
+    """Yield (doi, [(classification id, subject name, weight)]) for every DOI the
+    data source classifies, in the same byte order as the sorted CSV."""
+    q = select([Identifier.identifier, Classification.id, Subject.name, Classification.weight]).\
+        select_from(Classification.__table__.join(Identifier.__table__).join(Subject.__table__)).\
+        where(Classification.data_source_id == data_source.id).\
+        order_by(Identifier.identifier.collate('C'), Classification.id)
+    rows = connection.execution_options(stream_results=True).execute(q)
+    for (doi, group) in groupby(rows, key=lambda row: row[0]):
+        yield (doi, [(classification_id, name, weight) for (doi, classification_id, name, weight) in group])
+
+def merge_by_doi(csv_subjects, stored_subjects):
+    """Walk two DOI-ordered streams together, yielding (doi, csv subjects or None, stored rows or []))."""
+    csv_item = next(csv_subjects, None)
+    stored_item = next(stored_subjects, None)
+    while csv_item != None or stored_item != None:
+        if stored_item == None or (csv_item != None and csv_item[0] < stored_item[0]):
+            yield (csv_item[0], csv_item[1], [])
+            csv_item = next(csv_subjects, None)
+        elif csv_item == None or stored_item[0] < csv_item[0]:
+            yield (stored_item[0], None, stored_item[1])
+            stored_item = next(stored_subjects, None)
+        else:
+            yield (csv_item[0], csv_item[1], stored_item[1])
+            csv_item = next(csv_subjects, None)
+            stored_item = next(stored_subjects, None)
+
+def delta_load_subjects(data_source, csv_path, batch_rows=10000):
+    """Bring the data source's classifications in line with a full, DOI-sorted
+    export by merging it against the stored rows, which are streamed in the same
+    order over a second connection. Only added, removed and reweighted
+    classifications are written; DOIs missing from the export lose theirs.
+    Returns a dict of counts."""
+    check_sorted_by_doi(csv_path)
+    counts = dict(subjects=0, identifiers=0, added=0, removed=0, reweighted=0, unchanged=0)
+    adds = []
+    removes = []
+    reweights = []
+    connection = db_session.get_bind().engine.connect()
+    try:
+        stored_subjects = stored_subjects_by_doi(connection, data_source)
+        for (doi, wanted, stored) in merge_by_doi(csv_subjects_by_doi(csv_path), stored_subjects):
+            wanted = wanted or {}
+            seen = set()
+            for (classification_id, name, weight) in stored:
+                if name not in wanted or name in seen:
+                    removes.append(classification_id)
+                elif wanted[name] != weight:
+                    reweights.append(dict(b_id=classification_id, b_weight=wanted[name]))
+                else:
+                    counts['unchanged'] += 1
+                seen.add(name)
+            adds.extend((doi, name, weight) for (name, weight) in wanted.items() if name not in seen)
+            if len(adds) + len(removes) + len(reweights) >= batch_rows:
+                apply_subject_delta(data_source, adds, removes, reweights, counts)
+                (adds, removes, reweights) = ([], [], [])
+        apply_subject_delta(data_source, adds, removes, reweights, counts)
+    finally:
+        connection.close()
+    return counts
+
+def apply_subject_delta(data_source, adds, removes, reweights, counts):
+    """Write one batch of the diff: adds are (doi, subject name, weight),
+    removes classification ids, reweights dicts of b_id and b_weight."""
+    if adds:
+        names = {name for (doi, name, weight) in adds}
+        (found, missing) = subject_ids.lookup_many(names)
+        found.update(ids_by(db_session, Subject, ('name',), missing))
+        # subjects have no type, so the (type, name) constraint cannot catch duplicates: insert only unseen names
+        new_subjects = insert_ignore(db_session, Subject, [dict(name=name) for name in sorted(names - set(found))],
+            returning=[Subject.id, Subject.name])
+        found.update({name: subject_id for (subject_id, name) in new_subjects})
+        subject_ids.update(found)
+        dois = sorted({doi for (doi, name, weight) in adds})
+        new_identifiers = insert_ignore(db_session, Identifier,
+            [dict(type='DOI', identifier=doi) for doi in dois], returning=[Identifier.id])
+        doi_ids = ids_by(db_session, Identifier, ('identifier',), dois, Identifier.type == 'DOI')
+        insert_ignore(db_session, Classification, [
+            dict(identifier_id=doi_ids[doi], subject_id=found[name], data_source_id=data_source.id, weight=weight)
+            for (doi, name, weight) in adds
+        ])
+        counts['subjects'] += len(new_subjects)
+        counts['identifiers'] += len(new_identifiers)
+        counts['added'] += len(adds)
+    if removes:
+        classifications = Classification.__table__
+        db_session.execute(classifications.delete().where(classifications.c.id.in_(removes)))
+        counts['removed'] += len(removes)
+    if reweights:
+        classifications = Classification.__table__
+        db_session.execute(classifications.update().where(classifications.c.id == bindparam('b_id')).
+            values(weight=bindparam('b_weight')), reweights)
+        counts['reweighted'] += len(reweights)
+    db_session.commit()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load Springer subject classifications from the subjects CSV.")
+    parser.add_argument("--bulk", action="store_true",
+        help="create subjects in one batch and upsert classifications in multi-row batches")
+    parser.add_argument("--batch-rows", type=int, default=10000,
+        help="classifications per bulk upsert and commit")
+    parser.add_argument("--delta", action="store_true",
+        help="diff a full DOI-sorted export against stored classifications and write only the changes")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    find_with = dict(
+        name='SpringerNature',
+        primary_identifier_type='DOI'
+    )
+    create_with = dict()
+    data_source, new = get_one_or_create(
+        db_session, DataSource, create_method_kwargs=create_with, **find_with
+    )
+    warm_caches(db_session, (identifier_ids, subject_ids))
+    csv_path = config['CSV']['springerSubjects']
+    if args.delta:
+        counts = delta_load_subjects(data_source, csv_path, args.batch_rows)
+        (num_subjects, num_identifiers) = (counts['subjects'], counts['identifiers'])
+        print("%s classifications added, %s removed, %s reweighted, %s unchanged" % (str(counts['added']),
+            str(counts['removed']), str(counts['reweighted']), str(counts['unchanged'])))
+    elif args.bulk:
+        (num_subjects, num_identifiers) = bulk_load_subjects(data_source, csv_path, args.batch_rows)
+    else:
+        (num_subjects, num_identifiers) = load_subjects(data_source, csv_path)
     print("%s new subjects, %s new identifiers" % (str(num_subjects), str(num_identifiers)))
+    for stats in cache_stats((identifier_ids, subject_ids)): print(stats)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,82 @@
+# Runs against the database in config.ini; every row it makes is rolled back.
+import json
+import unittest
+from datetime import date, datetime
+from springer import db_session
+from springer.model import (
+    Classification, Contribution, Contributor, DataSource, Edition, Equivalency, Identifier, Resource, Subject
+)
+from sqlalchemy import event
+from springer_opds_for_subjects import PageExporter
+
+class TestPageQueryCount(unittest.TestCase):
+    """Rendering a page takes the same number of queries whatever its size,
+    including sizes on either side of any batch the exporter works in."""
+
+    PUBLICATIONS = 251
+
+    def setUp(self):
+        data_source = DataSource(name='Query count test')
+        subject = Subject(name='Query count test subject')
+        db_session.add_all([data_source, subject])
+        db_session.flush()
+        self.identifier_ids = []
+        for number in range(self.PUBLICATIONS):
+            doi = Identifier(type='DOI', identifier='10.0000/query-count-test-%s' % number)
+            isbn = Identifier(type='ISBN', identifier='000-0-00-%06d-0' % number)
+            db_session.add_all([doi, isbn])
+            db_session.flush()
+            edition = Edition(data_source_id=data_source.id, primary_identifier_id=doi.id,
+                title='Title %s' % number, language='eng', published=date(2020, 1, 1), modified=datetime(2020, 1, 1))
+            contributors = [Contributor(name='Query count author %s.%s' % (number, index)) for index in range(2)]
+            db_session.add_all([edition] + contributors)
+            db_session.flush()
+            db_session.add_all([Contribution(edition_id=edition.id, contributor_id=contributor.id, role='Author')
+                for contributor in contributors])
+            db_session.add_all([
+                Equivalency(input_id=doi.id, output_id=isbn.id, data_source_id=data_source.id),
+                Resource(data_source_id=data_source.id, identifier_id=doi.id, url='https://example.org/%s.pdf' % number,
+                    media_type='application/pdf'),
+                Classification(identifier_id=doi.id, subject_id=subject.id, data_source_id=data_source.id, weight=100)
+            ])
+            self.identifier_ids.append(doi.id)
+        db_session.flush()
+        # fragments are written to the cache a batch of renders at a time, so reads are what is counted
+        self.queries = 0
+        event.listen(db_session.get_bind().engine, 'before_cursor_execute', self.count_select)
+
+    def tearDown(self):
+        event.remove(db_session.get_bind().engine, 'before_cursor_execute', self.count_select)
+        db_session.rollback()
+
+    def count_select(self, connection, cursor, statement, *args):
+        if statement.lstrip().upper().startswith('SELECT'): self.queries += 1
+
+    def render_page(self, size, use_fragments):
+        # the identifiers made above are numbered in order, so this page holds exactly size of them
+        exporter = PageExporter(None, size, size, use_fragments=use_fragments)
+        start_id = self.identifier_ids[0]
+        end_id = self.identifier_ids[size]
+        self.queries = 0
+        publications = [json.loads(text) for (identifier_id, doi, text) in exporter.page_publications(start_id, end_id)]
+        queries = self.queries
+        db_session.expunge_all()
+        self.assertEqual(size, len(publications))
+        self.assertTrue(all(publication['metadata'].get('author') for publication in publications))
+        return (queries, exporter.rendered)
+
+    def test_query_count_is_constant_per_page(self):
+        self.assertEqual(self.render_page(10, False)[0], self.render_page(250, False)[0])
+
+    def test_query_count_is_constant_per_page_of_fragments(self):
+        # the second page renders the 240 publications the first did not cache
+        (small_queries, small_rendered) = self.render_page(10, True)
+        (large_queries, large_rendered) = self.render_page(250, True)
+        self.assertEqual((10, 240), (small_rendered, large_rendered))
+        self.assertEqual(small_queries, large_queries)
+        # then both are served from the cache alone
+        self.assertEqual(self.render_page(10, True), self.render_page(250, True))
+        self.assertEqual(0, self.render_page(250, True)[1])
+
+if __name__ == '__main__':
+    unittest.main()